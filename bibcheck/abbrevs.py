@@ -1,26 +1,425 @@
 import json
 import os
+import re
 import difflib
+import hashlib
+import heapq
+import mmap
+import struct
 import sys
+from array import array
+from collections import Counter, OrderedDict
+
+JSON_PATH = os.path.join(os.path.dirname(__file__), 'abbreviations.json')
+DB_PATH = os.path.join(os.path.dirname(__file__), 'abbreviations.db')
+
+# layout of the compiled database (see compile_table): a header followed by
+# these sections, each an array of native unsigned ints ('I'), signed ints
+# ('i'), shorts ('H'), bytes ('B') or raw utf-8 ('s')
+DB_MAGIC = b'BIBCHKDB'
+DB_FORMAT = 1
+DB_SECTIONS = (
+    ('str_offsets', 'I'), ('str_data', 's'),
+    ('is_abbrev', 'B'), ('abbrev_of', 'i'), ('full_of', 'i'),
+    ('key_offsets', 'I'), ('key_data', 's'), ('key_target', 'i'),
+    ('gram_offsets', 'I'), ('gram_data', 's'),
+    ('post_offsets', 'I'), ('post_ids', 'I'), ('sizes', 'H'),
+    ('lengths', 'I'), ('length_offsets', 'I'), ('length_ids', 'I'),
+)
+DB_HEADER = struct.Struct('=8sII20s' + 'QQ' * len(DB_SECTIONS))
+DB_BYTEORDER = 0x01020304
+
+
+def trigrams(s):
+    """Returns the set of character trigrams of s, padded and case folded"""
+    s = '  ' + s.lower() + ' '
+    return set(s[i:i+3] for i in range(len(s) - 2))
+
+
+class TrigramIndex(object):
+    """Inverted index from character trigrams to the strings containing them.
+
+    Fuzzy lookups first score the few strings sharing the most trigrams with
+    the query. The best score found there bounds the ratio any other string
+    would need to win, and strings whose length or characters alone rule that
+    out are never scored, so the result is the same as a full difflib scan.
+    """
+
+    def __init__(self, strings, n_candidates=50):
+        self.strings = sorted(set(strings))
+        self.n_candidates = n_candidates
+        self.postings = {}
+        self.sizes = []
+        self.by_length = {}
+        for i, s in enumerate(self.strings):
+            grams = trigrams(s)
+            self.sizes.append(len(grams))
+            for g in grams:
+                self.postings.setdefault(g, []).append(i)
+            self.by_length.setdefault(len(s), []).append(s)
+
+    def candidates(self, word):
+        """Returns the strings sharing the most trigrams with word"""
+        grams = trigrams(word)
+        counts = Counter()
+        for g in grams:
+            counts.update(self.postings.get(g, ()))
+        n = len(grams)
+        sizes = self.sizes
+        best = heapq.nlargest(self.n_candidates, counts,
+                              key=lambda i: counts[i] / float(n + sizes[i]))
+        return [self.strings[i] for i in best]
+
+    def get_close_matches(self, word, n=3, cutoff=0.6):
+        """Same as difflib.get_close_matches(word, strings, n, cutoff)"""
+        result = []
+        s = difflib.SequenceMatcher()
+        s.set_seq2(word)
+        # deletes the characters of word, leaving those that can never match
+        unmatched = dict.fromkeys(map(ord, set(word)))
+        lb = len(word)
+
+        def score(x, bound):
+            la = len(x)
+            if 2.0 * (la - len(x.translate(unmatched))) / (la + lb) < bound:
+                return bound
+            s.set_seq1(x)
+            if s.real_quick_ratio() >= bound and \
+               s.quick_ratio() >= bound and \
+               s.ratio() >= bound:
+                heapq.heappush(result, (s.ratio(), x))
+                if len(result) > n:
+                    heapq.heappop(result)
+                if len(result) == n:
+                    return result[0][0]
+            return bound
+
+        bound = cutoff
+        seen = set(self.candidates(word))
+        for x in seen:
+            bound = score(x, bound)
+
+        # anything that could still beat the candidates must be long enough
+        for la in sorted(self.by_length, key=lambda la: abs(la - lb)):
+            if 2.0 * min(la, lb) / (la + lb) < bound:
+                continue
+            for x in self.by_length[la]:
+                if x not in seen:
+                    bound = score(x, bound)
+
+        result = heapq.nlargest(n, result)
+        return [x for score, x in result]
+
+
+def normalize(journal):
+    """Returns the lookup key of a journal title: case folded, with runs of
+    whitespace and punctuation collapsed to a single space"""
+    return re.sub(r'[\W_]+', ' ', journal.lower(), flags=re.UNICODE).strip()
+
+
+class Table(object):
+    """Lookup maps and fuzzy index over the rows of abbreviations.json"""
+
+    def __init__(self, rows):
+        # several journals share a full title (the "Politehnica" bulletins
+        # for instance); the first row in abbreviations.json wins
+        self.abbrevs = set()
+        self.full_to_abbrev = {}
+        self.abbrev_to_full = {}
+        for abbrev, full in rows:
+            self.abbrevs.add(abbrev)
+            self.full_to_abbrev.setdefault(full, abbrev)
+            self.abbrev_to_full.setdefault(abbrev, full)
+
+        # normalized spellings of an abbreviation take precedence over those
+        # of a full title
+        self.by_key = {}
+        for abbrev, full in rows:
+            self.by_key.setdefault(normalize(abbrev), abbrev)
+        for abbrev, full in rows:
+            self.by_key.setdefault(normalize(full), abbrev)
+
+        self.index = TrigramIndex(list(self.abbrevs) + list(self.full_to_abbrev))
+
+
+class _Strings(object):
+    """Sorted utf-8 strings stored back to back in a memory-mapped section"""
+
+    def __init__(self, buf, base, offsets):
+        self.buf = buf
+        self.base = base
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self._bytes(i).decode('utf-8')
+
+    def _bytes(self, i):
+        return self.buf[self.base + self.offsets[i]:self.base + self.offsets[i + 1]]
+
+    def find(self, s):
+        """Returns the position of s, or -1"""
+        # utf-8 sorts bytewise in the same order as the decoded strings
+        b = s.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(mid) < b:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._bytes(lo) == b:
+            return lo
+        return -1
+
+
+class _Set(object):
+    def __init__(self, strings, flags):
+        self.strings = strings
+        self.flags = flags
+
+    def __contains__(self, s):
+        i = self.strings.find(s)
+        return i >= 0 and self.flags[i] != 0
+
+
+class _Map(object):
+    def __init__(self, keys, targets, values):
+        self.keys = keys
+        self.targets = targets
+        self.values = values
+
+    def _target(self, s):
+        i = self.keys.find(s)
+        return self.targets[i] if i >= 0 else -1
+
+    def __contains__(self, s):
+        return self._target(s) >= 0
+
+    def __getitem__(self, s):
+        t = self._target(s)
+        if t < 0:
+            raise KeyError(s)
+        return self.values[t]
+
+    def get(self, s, default=None):
+        t = self._target(s)
+        return self.values[t] if t >= 0 else default
+
+
+class _Postings(object):
+    def __init__(self, grams, offsets, ids):
+        self.grams = grams
+        self.offsets = offsets
+        self.ids = ids
+
+    def get(self, g, default=None):
+        i = self.grams.find(g)
+        if i < 0:
+            return default
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+
+class _ByLength(object):
+    def __init__(self, lengths, offsets, ids, strings):
+        self.lengths = lengths
+        self.position = dict((la, i) for i, la in enumerate(lengths))
+        self.offsets = offsets
+        self.ids = ids
+        self.strings = strings
+
+    def __iter__(self):
+        return iter(self.lengths)
+
+    def __getitem__(self, la):
+        i = self.position[la]
+        return [self.strings[j] for j in self.ids[self.offsets[i]:self.offsets[i + 1]]]
+
+
+class CompiledIndex(TrigramIndex):
+    def __init__(self, strings, postings, sizes, by_length, n_candidates=50):
+        self.strings = strings
+        self.postings = postings
+        self.sizes = sizes
+        self.by_length = by_length
+        self.n_candidates = n_candidates
+
+
+class CompiledTable(object):
+    """Same interface as Table, answered straight from the memory-mapped
+    database written by compile_table. Strings are only decoded when a
+    lookup touches them.
+
+    Raises ValueError if the database was not compiled from the table with
+    the given version.
+    """
+
+    def __init__(self, path, version):
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buf) < DB_HEADER.size:
+            raise ValueError('truncated abbreviation database')
+        header = DB_HEADER.unpack_from(self.buf)
+        magic, fmt, byteorder, digest = header[:4]
+        if magic != DB_MAGIC or fmt != DB_FORMAT or byteorder != DB_BYTEORDER:
+            raise ValueError('unsupported abbreviation database')
+        if digest != bytes(bytearray.fromhex(version)):
+            raise ValueError('abbreviation database is stale')
+
+        view = memoryview(self.buf)
+        sections = {}
+        for i, (name, typecode) in enumerate(DB_SECTIONS):
+            offset, size = header[4 + 2 * i:6 + 2 * i]
+            if typecode == 's':
+                sections[name] = offset
+            else:
+                sections[name] = view[offset:offset + size].cast(typecode)
+
+        strings = _Strings(self.buf, sections['str_data'], sections['str_offsets'])
+        keys = _Strings(self.buf, sections['key_data'], sections['key_offsets'])
+        grams = _Strings(self.buf, sections['gram_data'], sections['gram_offsets'])
+
+        self.abbrevs = _Set(strings, sections['is_abbrev'])
+        self.full_to_abbrev = _Map(strings, sections['abbrev_of'], strings)
+        self.abbrev_to_full = _Map(strings, sections['full_of'], strings)
+        self.by_key = _Map(keys, sections['key_target'], strings)
+        self.index = CompiledIndex(
+            strings,
+            _Postings(grams, sections['post_offsets'], sections['post_ids']),
+            sections['sizes'],
+            _ByLength(sections['lengths'], sections['length_offsets'],
+                      sections['length_ids'], strings))
+
+
+def table_version(json_path=JSON_PATH):
+    """Returns the sha1 hex digest of the abbreviation table"""
+    with open(json_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _pack_strings(strings):
+    data = [s.encode('utf-8') for s in strings]
+    offsets = array('I', [0])
+    for b in data:
+        offsets.append(offsets[-1] + len(b))
+    return offsets, b''.join(data)
+
+
+def compile_table(json_path=JSON_PATH, db_path=DB_PATH):
+    """Compiles abbreviations.json and its lookup indexes to the binary
+    database that Validator memory-maps"""
+    with open(json_path) as f:
+        table = Table(json.load(f))
+
+    strings = table.index.strings
+    ids = dict((s, i) for i, s in enumerate(strings))
+    keys = sorted(table.by_key)
+    grams = sorted(table.index.postings)
+    lengths = sorted(table.index.by_length)
+
+    sections = {}
+    sections['str_offsets'], sections['str_data'] = _pack_strings(strings)
+    sections['is_abbrev'] = array('B', [s in table.abbrevs for s in strings])
+    sections['abbrev_of'] = array('i', [ids.get(table.full_to_abbrev.get(s), -1) for s in strings])
+    sections['full_of'] = array('i', [ids.get(table.abbrev_to_full.get(s), -1) for s in strings])
+    sections['key_offsets'], sections['key_data'] = _pack_strings(keys)
+    sections['key_target'] = array('i', [ids[table.by_key[k]] for k in keys])
+    sections['gram_offsets'], sections['gram_data'] = _pack_strings(grams)
+    sections['post_offsets'] = array('I', [0])
+    sections['post_ids'] = array('I')
+    for g in grams:
+        sections['post_ids'].extend(table.index.postings[g])
+        sections['post_offsets'].append(len(sections['post_ids']))
+    sections['sizes'] = array('H', table.index.sizes)
+    sections['lengths'] = array('I', lengths)
+    sections['length_offsets'] = array('I', [0])
+    sections['length_ids'] = array('I')
+    for la in lengths:
+        sections['length_ids'].extend(ids[s] for s in table.index.by_length[la])
+        sections['length_offsets'].append(len(sections['length_ids']))
+
+    blobs = []
+    layout = []
+    offset = DB_HEADER.size
+    for name, typecode in DB_SECTIONS:
+        blob = sections[name]
+        if typecode != 's':
+            blob = blob.tobytes()
+        # keep every array aligned for memoryview.cast
+        padding = b'\0' * (-offset % 8)
+        offset += len(padding)
+        blobs.append(padding + blob)
+        layout.extend((offset, len(blob)))
+        offset += len(blob)
+
+    digest = bytes(bytearray.fromhex(table_version(json_path)))
+    with open(db_path, 'wb') as f:
+        f.write(DB_HEADER.pack(DB_MAGIC, DB_FORMAT, DB_BYTEORDER, digest, *layout))
+        for blob in blobs:
+            f.write(blob)
+
 
 class Validator(object):
-    def __init__(self):
-        with open(os.path.join(os.path.dirname(__file__), 'abbreviations.json')) as f:
-            self.table = json.load(f)
-        self.abbrevs = [r[0] for r in self.table]
-        self.fulltitles = [r[1] for r in self.table]
+    """Recommends abbreviations for journal titles.
+
+    The table comes from the compiled abbreviations.db when it is present
+    and up to date with abbreviations.json, and from the JSON otherwise.
+
+    Recommendations are memoized per journal string, so a bibliography
+    citing the same journal thousands of times only scores it once. Pass
+    cache_size to bound the memo to the most recently used titles when the
+    validator is long lived.
+    """
 
-        self.all = self.abbrevs + self.fulltitles
+    def __init__(self, cache_size=None):
+        self.version = table_version()
+        try:
+            table = CompiledTable(DB_PATH, self.version)
+        except (IOError, OSError, ValueError):
+            with open(JSON_PATH) as f:
+                table = Table(json.load(f))
+
+        self.abbrevs = table.abbrevs
+        self.full_to_abbrev = table.full_to_abbrev
+        self.abbrev_to_full = table.abbrev_to_full
+        self.by_key = table.by_key
+        self.index = table.index
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
 
     def validate(self, journal):
-        if journal not in self.abbrevs:
-            matches = difflib.get_close_matches(journal, self.all, n=1)
-            if len(matches) == 0:
-                return None
-            closest = matches[0]
-            if closest in self.fulltitles:
-                i = self.fulltitles.index(closest)
-                closest = self.abbrevs[i]
-            
-            return closest
-        return None
+        """Returns the recommended abbreviation for journal, or None if it
+        is already correct or nothing close is known"""
+        try:
+            recommendation = self.cache.pop(journal)
+        except KeyError:
+            self.misses += 1
+            recommendation = self.recommend(journal)
+        else:
+            self.hits += 1
+        # re-inserting keeps the most recently used titles at the end
+        self.cache[journal] = recommendation
+        if self.cache_size is not None and len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return recommendation
+
+    def recommend(self, journal):
+        """Uncached version of validate"""
+        if journal in self.abbrevs:
+            return None
+        if journal in self.full_to_abbrev:
+            return self.full_to_abbrev[journal]
+        key = normalize(journal)
+        if key in self.by_key:
+            return self.by_key[key]
+
+        matches = self.index.get_close_matches(journal, n=1)
+        if len(matches) == 0:
+            return None
+        closest = matches[0]
+        return self.full_to_abbrev.get(closest, closest)
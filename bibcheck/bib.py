@@ -20,11 +20,16 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 from __future__ import print_function, absolute_import
-import os
 import re
 import sys
 import json
+import multiprocessing
+from array import array
 from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 from pprint import pprint
 from six import iteritems
 PY3 = sys.version_info[0] == 3
@@ -37,6 +42,9 @@ else:
         return iter(d.iteritems(**kw))
 
 from . import abbrevs
+from . import names
+from . import report
+from . import schemas
 
 def clear_comments(data):
     """Return the bibtex content without comments"""
@@ -50,35 +58,520 @@ def log( f ):
 def warn(msg):
     print('Warning: {}'.format(msg))
 
+_boundary_re = re.compile(r'[@{}"\n]')
+_brace_re = re.compile(r'[{}]')
+# the tokens of Bibparser.token_re which make up values
+_value_token_re = re.compile(r"[^\s\"#'(){}@,=]+|[@\"{}=,]")
+_string_re = re.compile(r'@\s*string(?![^\s"#\'(){}@,=])', re.IGNORECASE)
+
+def iter_entries(chunks):
+    """Splits bibtex text into entries.
+
+    chunks is an iterable of strings (e.g. successive reads of a file) which
+    together form the bibtex source. Yields (line, text) for each entry,
+    where text runs from an @ which is outside of any braces or quotes up
+    to the next such @, and line is the line that @ is on. Text before the
+    first entry is dropped; the parser ignores it anyway.
+
+    Only the entry being split is buffered, so memory use is bounded by
+    the largest entry rather than by the length of the source.
+    """
+    for offset, line, text in iter_entry_spans(chunks):
+        yield line, text
+
+def iter_entry_spans(chunks, line=1):
+    """Same as iter_entries, but yields (offset, line, text) where offset is
+    the position of the entry in the source. line is the line the source
+    starts on."""
+    buf = ''
+    base = 0
+    pos = 0
+    start = None
+    start_line = None
+    depth = 0
+    quoted = False
+    for chunk in chunks:
+        buf += chunk
+        for item in _boundary_re.finditer(buf, pos):
+            c = item.group()
+            if c == '\n' :
+                line += 1
+            elif c == '"' :
+                # like the parser, only a quote delimiting a field value
+                # hides braces
+                if depth == 1 :
+                    quoted = not quoted
+            elif quoted :
+                pass
+            elif c == '{' :
+                depth += 1
+            elif c == '}' :
+                depth = max(depth - 1, 0)
+            elif depth == 0 :
+                if start is not None :
+                    yield base + start, start_line, buf[start:item.start()]
+                start = item.start()
+                start_line = line
+        # drop what has been split off already
+        if start is None :
+            base += len(buf)
+            buf = ''
+        else :
+            base += start
+            buf = buf[start:]
+            start = 0
+        pos = len(buf)
+    if start is not None :
+        yield base + start, start_line, buf[start:]
+
+class Shape(object):
+    """The field names of the records which have the same fields in the same
+    order, shared by all of them.
+
+    Shapes are interned: adding a field to a record moves it to the child
+    shape with that field appended, so records parsed from similar entries
+    share one names tuple, index and schemas.field_mask.
+    """
+    __slots__ = ('names', 'index', 'mask', 'children')
+
+    def __init__(self, names):
+        self.names = names
+        self.index = dict((name, i) for i, name in enumerate(names))
+        self.mask = schemas.field_mask(names)
+        self.children = {}
+
+    def add(self, name):
+        """Returns the shape with name appended"""
+        shape = self.children.get(name)
+        if shape is None:
+            shape = self.children[name] = Shape(self.names + (sys.intern(name),))
+        return shape
+
+    @staticmethod
+    def of(names):
+        """Returns the shape of the field names"""
+        shape = EMPTY_SHAPE
+        for name in names:
+            shape = shape.add(name)
+        return shape
+
+EMPTY_SHAPE = Shape(())
+
+class Record(Mapping):
+    """A parsed entry, mapping field names to values.
+
+    The field names are kept in the entry's Shape, so a record only holds
+    its values, and the line each field starts on. Fields set with
+    set_source only keep where their text is in the source, and are decoded
+    and normalized when first read. The entry type, lower case, is kept
+    apart from the fields, in entry_type, so that it is not confused with a
+    type field. Also remembers where the entry came from: start_line and
+    end_line are the lines of its opening @ and closing brace. Besides the
+    read-only mapping methods, fields can be assigned and deleted.
+    """
+    __slots__ = ('entry_type', 'shape', '_values', 'field_lines', 'source', 'spans', 'start_line', 'end_line')
+
+    def __init__(self, fields=(), entry_type=None):
+        self.entry_type = entry_type
+        self.shape = EMPTY_SHAPE
+        self._values = []
+        # 0 for fields not read from a .bib file
+        self.field_lines = array('l')
+        # the text the fields set with set_source are in, and the start and
+        # end offsets of each field in it, -1 for the others
+        self.source = None
+        self.spans = None
+        self.start_line = None
+        self.end_line = None
+        if isinstance(fields, Mapping):
+            fields = fields.items()
+        for key, value in fields:
+            self.set(key, value)
+
+    def __getitem__(self, key):
+        i = self.shape.index[key]
+        value = self._values[i]
+        if value is _UNDECODED:
+            raw = self.source[self.spans[2 * i]:self.spans[2 * i + 1]]
+            value = self._values[i] = normalize(key, field_text(key, raw))
+        return value
+
+    def __contains__(self, key):
+        return key in self.shape.index
+
+    def __iter__(self):
+        return iter(self.shape.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        if key not in self.shape.index:
+            return default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, line=0):
+        """Sets the field key to value, read from line if given"""
+        i = self.shape.index.get(key)
+        if i is None:
+            self.shape = self.shape.add(key)
+            self._values.append(value)
+            self.field_lines.append(line)
+            if self.spans is not None:
+                self.spans.extend((-1, -1))
+        else:
+            self._values[i] = value
+            if line:
+                self.field_lines[i] = line
+            if self.spans is not None:
+                self.spans[2 * i] = self.spans[2 * i + 1] = -1
+
+    def set_source(self, key, source, span, line=0):
+        """Sets the field key to the text at span, a Span of source, to be
+        decoded and normalized when it is first read"""
+        if self.spans is not None and self.source is not source:
+            # spans are offsets into one source only, so decode the fields
+            # read from the other one, before key is added undecoded
+            for k in self:
+                self[k]
+            self.spans = None
+        self.set(key, _UNDECODED, line)
+        if self.spans is None:
+            self.spans = array('l', [-1]) * (2 * len(self._values))
+        i = self.shape.index[key]
+        self.source = source
+        self.spans[2 * i], self.spans[2 * i + 1] = span
+
+    def raw(self):
+        """Returns the fields as a dict without decoding them, the fields
+        set with set_source as ['source', their text]"""
+        fields = {}
+        for i, name in enumerate(self.shape.names):
+            if self.spans is not None and self.spans[2 * i] >= 0:
+                fields[name] = ['source', self.source[self.spans[2 * i]:self.spans[2 * i + 1]]]
+            else:
+                fields[name] = self._values[i]
+        return fields
+
+    def text(self, key):
+        """Returns the field key as bibtex text: as written in the source,
+        with its whitespace collapsed, if it was set with set_source, and
+        converted back from CSL-JSON otherwise"""
+        i = self.shape.index[key]
+        if self.spans is not None and self.spans[2 * i] >= 0:
+            return ' '.join(self.source[self.spans[2 * i]:self.spans[2 * i + 1]].split())
+        value = self._values[i]
+        if isinstance(value, dict):
+            return value.get('literal', '')
+        if isinstance(value, list):
+            return ' and '.join(_author_text(author) for author in value)
+        return value
+
+    def __delitem__(self, key):
+        i = self.shape.index[key]
+        names = self.shape.names
+        self.shape = Shape.of(names[:i] + names[i + 1:])
+        del self._values[i]
+        del self.field_lines[i]
+        if self.spans is not None:
+            del self.spans[2 * i:2 * i + 2]
+
+    @property
+    def mask(self):
+        """The schemas.field_mask of the field names"""
+        return self.shape.mask
+
+    @property
+    def lines(self):
+        """Maps each field name to the line the field starts on"""
+        return dict((name, line) for name, line in zip(self.shape.names, self.field_lines) if line)
+
+    def move(self, delta):
+        """Moves all the lines of the record by delta"""
+        self.start_line += delta
+        if self.end_line is not None:
+            # None when the text ended inside the entry
+            self.end_line += delta
+        lines = self.field_lines
+        for i in range(len(lines)):
+            if lines[i]:
+                lines[i] += delta
+
+    def __reduce__(self):
+        # shapes and field bits differ between processes, so pickle names
+        return _record, (self.shape.names, self._values, self.field_lines,
+                         self.source, self.spans, self.start_line, self.end_line, self.entry_type)
+
+    def __repr__(self):
+        return 'Record(%r, %r)' % (dict(self), self.entry_type)
+
+def _record(names, values, field_lines, source, spans, start_line, end_line, entry_type=None):
+    """Unpickles a Record"""
+    record = Record(entry_type=entry_type)
+    record.shape = Shape.of(names)
+    record._values = values
+    record.field_lines = field_lines
+    record.source = source
+    record.spans = spans
+    record.start_line = start_line
+    record.end_line = end_line
+    return record
+
+def _author_text(author):
+    """Returns an Author in the "von Last, Jr, First" form"""
+    text = author.get('family', '')
+    if 'non-dropping-particle' in author:
+        text = author['non-dropping-particle'] + ' ' + text
+    if 'suffix' in author:
+        text += ', ' + author['suffix']
+    if 'given' in author:
+        text += ', ' + author['given']
+    return text
+
+class Author(Mapping):
+    """One name of an author field, mapping the CSL-JSON keys 'family' and,
+    for the parts the name has, 'given', 'non-dropping-particle' (the von
+    part) and 'suffix' (the jr part) to the (interned) parts"""
+    __slots__ = ('family', 'given', 'particle', 'suffix')
+
+    KEYS = ('family', 'given', 'non-dropping-particle', 'suffix')
+
+    def __init__(self, family, given=None, particle=None, suffix=None):
+        self.family = sys.intern(family)
+        self.given = given and sys.intern(given) or None
+        self.particle = particle and sys.intern(particle) or None
+        self.suffix = suffix and sys.intern(suffix) or None
+
+    def _get(self, key):
+        if key == 'family':
+            return self.family
+        if key == 'given':
+            return self.given
+        if key == 'non-dropping-particle':
+            return self.particle
+        if key == 'suffix':
+            return self.suffix
+        return None
+
+    def __getitem__(self, key):
+        value = self._get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key in self.KEYS:
+            if self._get(key) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return Author, (self.family, self.given, self.particle, self.suffix)
+
+    def __repr__(self):
+        return 'Author(%r)' % dict(self)
+
+class Span(tuple):
+    """The (start, end) offsets of a value's text in the source"""
+    __slots__ = ()
+
+    def __new__(cls, start, end):
+        return tuple.__new__(cls, (start, end))
+
+    start = property(lambda self: self[0])
+    end = property(lambda self: self[1])
+
+    def decode(self, source):
+        return decode(source[self[0]:self[1]])
+
+class _Undecoded(object):
+    """The value of a field set with Record.set_source, until it is read"""
+    def __reduce__(self):
+        # unpickled as the same object
+        return '_UNDECODED'
+
+_UNDECODED = _Undecoded()
+
+# bibtex fields which are renamed to their CSL-JSON names
+RENAMED = schemas.RENAMED
+
+def decode(raw):
+    """Returns the value of the text inside a field's braces or quotes,
+    as Bibparser.value reads it"""
+    return ' '.join(_value_token_re.findall(raw))
+
+def field_text(key, raw):
+    """Returns the text of the field key which normalize takes: the source
+    text of author and title fields, with its whitespace collapsed, since
+    their braces matter, and decode(raw) otherwise"""
+    if key == 'author' or key == 'title' :
+        return ' '.join(raw.split())
+    return decode(raw)
+
+def normalize(key, value):
+    """Converts the value of the field key (after RENAMED) to CSL-JSON"""
+    if key == 'author' :
+        return parse_authors(value)
+    if key == 'issued' :
+        return {'literal':value}
+    if key == 'page' :
+        return value.replace('--', '-')
+    if key == 'title' :
+        return capitalize_title(value)
+    return value
+
+_word_start_re = re.compile(r'(^|\s)(\S)')
+
+def _capitalize(match):
+    return match.group(1) + match.group(2).upper()
+
+def capitalize_title(title):
+    """Removes the braces protecting parts of title, capitalizing the words
+    inside them.
+
+    Preserves capitalization, as described in
+    http://tex.stackexchange.com/questions/7288/preserving-capitalization-in-bibtex-titles
+    A group runs from a brace at the top level to the brace closing it, so
+    nested braces are dropped along with the outer ones. An unmatched }
+    is kept, and an unmatched { protects the rest of the title.
+    """
+    out = []
+    parts = None
+    depth = 0
+    pos = 0
+    for item in _brace_re.finditer(title):
+        i = item.start()
+        if item.group() == '{' :
+            if depth == 0 :
+                out.append(title[pos:i])
+                parts = []
+            else :
+                parts.append(title[pos:i])
+            depth += 1
+            pos = i + 1
+        elif depth :
+            parts.append(title[pos:i])
+            pos = i + 1
+            depth -= 1
+            if depth == 0 :
+                out.append(_protect(parts))
+    if depth :
+        parts.append(title[pos:])
+        out.append(_protect(parts))
+    else :
+        out.append(title[pos:])
+    return ''.join(out)
+
+def _protect(parts):
+    """Returns the text of a brace group, split at its inner braces"""
+    text = ''.join(parts)
+    if len(parts) > 1 :
+        # the inner braces of decoded text are set off by spaces
+        text = ' '.join(text.split())
+    return _word_start_re.sub(_capitalize, text).strip()
+
+def parse_authors(authors):
+    """Splits an author field into Authors"""
+    res = []
+    for author in names.split_names(authors):
+        name = names.parse_name(author)
+        res.append(Author(name.last, name.first, name.von, name.jr))
+    return res
+
 class Bibparser() :
     """Main class for Bibtex parsing"""
 
-    def tokenize(self) :
-        """Returns a token iterator"""
-        for item in self.token_re.finditer(self.data):
-            i = item.group(0)
-            if self.white.match(i) :
-                if self.nl.match(i) :
-                    self.line += 1
-                continue
+    # one alternative per token type; newlines are only matched to count
+    # lines, other whitespace and the characters #'() are skipped
+    token_re = re.compile(r"(?P<word>[^\s\"#'(){}@,=]+)|(?P<nl>\n)|(?P<punct>[@\"{}=,])")
+
+    def tokenize(self, pos=0, line=None) :
+        """Returns an iterator of (type, token, line) tuples, from offset pos
+        of self.data on. self.pos is set to the offset past each token."""
+        if line is None :
+            line = self.line
+        for item in self.token_re.finditer(self.data, pos):
+            token_type = item.lastgroup
+            if token_type == 'nl' :
+                line += 1
             else :
-                yield i
+                self.pos = item.end()
+                yield token_type, item.group(), line
 
     def __init__(self, data, verbose=False):
         self.data = data
         self.token = None
         self.token_type = None
-        self._next_token = self.tokenize().__next__
         self.hashtable = {}
         self.mode = None
         self.records = OrderedDict()
         self.line = 1
+        self.entry_line = None
+        self.pos = 0
         self.verbose = verbose
-
-        # compile some regexes
-        self.white = re.compile(r"[\n|\s]+")
-        self.nl = re.compile(r"[\n]")
-        self.token_re = re.compile(r"([^\s\"#'(){}@,=]+|\n|@|\"|{|}|=|,)")
+        self._next_token = self.tokenize().__next__
+        if verbose:
+            self.next_token = self.next_token_verbose
+
+    def iter_records(self, fileobj, chunk_size=1 << 16, jobs=1, batch_size=100):
+        """Parses the bibtex in fileobj one entry at a time.
+
+        Yields (key, record) pairs in file order. Unlike parse, records are
+        not kept in self.records, so memory use is bounded by the largest
+        entry rather than by the size of the file. @string macros are
+        remembered as in parse. A key that occurs twice is yielded twice.
+
+        With jobs > 1, batches of batch_size entries are parsed by a pool of
+        that many processes instead. Each batch is sent along with the
+        macros defined before it, so the records are the same as with one
+        job.
+        """
+        chunks = iter(lambda: fileobj.read(chunk_size), '')
+        entries = iter_entries(chunks)
+        if jobs > 1 :
+            pool = multiprocessing.Pool(jobs)
+            try :
+                for records in pool.imap(_parse_entries, self._batches(entries, batch_size)):
+                    for record in records:
+                        yield record
+            finally :
+                pool.terminate()
+        else :
+            for line, text in entries:
+                for record in self.parse_entry(line, text):
+                    yield record
+
+    def _batches(self, entries, batch_size):
+        """Groups entries into jobs for _parse_entries"""
+        batch = []
+        hashtable = dict(self.hashtable)
+        for line, text in entries:
+            batch.append((line, text))
+            if _string_re.match(text):
+                # the macro applies to the following batches
+                self.parse_entry(line, text)
+            if len(batch) == batch_size:
+                yield batch, hashtable, self.verbose
+                batch = []
+                hashtable = dict(self.hashtable)
+        if batch:
+            yield batch, hashtable, self.verbose
+
+    def parse_entry(self, line, text):
+        """Parses text, an entry starting on line as split by iter_entries.
+        Returns the list of (key, record) pairs it defines."""
+        self.data = text
+        self.line = line
+        self._next_token = self.tokenize().__next__
+        self.parse()
+        records = list(self.records.items())
+        self.records.clear()
+        return records
 
     def parse(self) :
         """Parses self.data and stores the parsed bibtex to self.rec"""
@@ -92,14 +585,18 @@ class Bibparser() :
 
     def next_token(self):
         """Returns next token"""
-        self.token = self._next_token()
-        if self.verbose:
-            print((self.line, self.token))
+        self.token_type, self.token, self.line = self._next_token()
+
+    def next_token_verbose(self):
+        """Returns next token, printing it"""
+        self.token_type, self.token, self.line = self._next_token()
+        print((self.line, self.token))
 
     @log
     def database(self) :
         """Database"""
         if self.token == '@' :
+            self.entry_line = self.line
             self.next_token()
             self.entry()
 
@@ -136,6 +633,8 @@ class Bibparser() :
             self.next_token()
             value = self.value()
             if self.mode == 'string' :
+                if isinstance(value, Span) :
+                    value = value.decode(self.data)
                 self.hashtable[name] = value
             return (name, value)
 
@@ -146,7 +645,16 @@ class Bibparser() :
         val = []
 
         while True :
-            if self.token == '"' :
+            span = None
+            if self.token == '{' or self.token == '"' :
+                span = self.skip_group()
+            if span is not None :
+                self.next_token()
+                if not val and re.match(r"}|,", self.token) :
+                    # the whole value, decoded when it is first read
+                    return span
+                val.extend(_value_token_re.findall(self.data, span.start, span.end))
+            elif self.token == '"' :
                 while True:
                     self.next_token()
                     if self.token == '"' :
@@ -201,6 +709,29 @@ class Bibparser() :
         value = ' '.join(val)
         return value
 
+    def skip_group(self):
+        """Moves the tokenizer past the braced or quoted group opened by the
+        current token, without tokenizing it. Returns the Span of its
+        contents, or None if the group is not closed."""
+        start = self.pos
+        end = -1
+        if self.token == '"' :
+            end = self.data.find('"', start)
+        else :
+            depth = 0
+            for item in _brace_re.finditer(self.data, start) :
+                if item.group() == '{' :
+                    depth += 1
+                elif depth :
+                    depth -= 1
+                else :
+                    end = item.start()
+                    break
+        if end < 0 :
+            return None
+        self._next_token = self.tokenize(end + 1, self.line + self.data.count('\n', start, end)).__next__
+        return Span(start, end)
+
     def query_hashtable( self, s ) :
         if s in self.hashtable :
             return self.hashtable[ self.token ]
@@ -230,38 +761,32 @@ class Bibparser() :
             if self.token == '{' :
                 self.next_token()
                 key = self.key()
-                self.records[ key ] = {}
-                self.records[ key ]['type'] = record_type.lower()
+                self.records[ key ] = Record(entry_type=sys.intern(record_type.lower()))
                 self.records[ key ]['id'] = key
+                self.records[ key ].start_line = self.entry_line
                 if self.token == ',' :
                     while True:
                         self.next_token()
+                        if self.token == '}' :
+                            # trailing comma after the last field
+                            break
+                        field_line = self.line
                         field = self.field()
                         if field :
                             k = field[0]
                             val = field[1]
 
-                            if k == 'author' :
-                                val = self.parse_authors(val)
-
-                            if k == 'year' :
-                                val = {'literal':val}
-                                k = 'issued'
-
-                            if k == 'pages' :
-                                val = val.replace('--', '-')
-                                k = 'page'
-
-                            if k == 'title' :
-                                #   Preserve capitalization, as described in http://tex.stackexchange.com/questions/7288/preserving-capitalization-in-bibtex-titles
-                                #   This will likely choke on nested curly-brackets, but that doesn't seem like an ordinary practice.
-                                def capitalize(s):
-                                    return s.group(1) + s.group(2).upper()
-                                while val.find('{') > -1:
-                                    caps = (val.find('{'), val.find('}'))
-                                    val = val.replace(val[caps[0]:caps[1]+1], re.sub("(^|\s)(\S)", capitalize, val[caps[0]+1:caps[1]]).strip())
-
-                            self.records[ key ][k] = val
+                            if k in ('issued', 'page') :
+                                # only the renamed year and pages are normalized
+                                if isinstance(val, Span) :
+                                    val = val.decode(self.data)
+                                self.records[ key ].set(k, val, field_line)
+                            else :
+                                k = RENAMED.get(k.lower(), k)
+                                if isinstance(val, Span) :
+                                    self.records[ key ].set_source(k, self.data, val, field_line)
+                                else :
+                                    self.records[ key ].set(k, normalize(k, val), field_line)
                         if self.token != ',' :
                             break
                     if self.token == '}' :
@@ -274,64 +799,121 @@ class Bibparser() :
                             pass
                         else:
                             raise NameError("@ missing %s" % self.token)
+                self.records[ key ].end_line = self.line
 
     def parse_authors(self, authors):
-        res = []
-        authors = authors.split(' and ')
-        for author in authors:
-            _author = author.split(',')
-            family = _author[0].strip().rstrip()
-            rec = {'family': family}
-            try :
-                given = _author[1].strip().rstrip()
-                rec['given'] = given
-            except IndexError:
-                pass
-            res.append(rec)
-        return res
+        return parse_authors(authors)
 
     def json(self) :
         """Returns json formated records"""
-        return json.dumps({'items':self.records.values()})
-
-    def validate(self, schema):
-        warner = Warner()
+        return json.dumps({'items':[json_item(record) for record in self.records.values()]}, default=dict)
+
+    def validate(self, schema, journal_validator=None, stats=False, records=None, out=None, cache=None,
+                 reporter=None):
+        """Checks records against the journal abbreviations and schema, which
+        is anything schemas.compile takes. With several schemas, each record
+        is checked against all of them and the report names the schemas
+        requiring each missing field.
+
+        records is an iterable of (key, record) pairs, such as the one
+        returned by iter_records; it defaults to self.records. The findings
+        are reported to reporter, a report.Reporter, by default one writing
+        text to out, sys.stdout by default. Validation stops early once the
+        reporter is full. Returns a dict counting the entries validated, the
+        errors and the warnings.
+
+        cache is an optional cache.ResultCache; records found in it are
+        not checked again.
+        """
+        if records is None:
+            records = iteritems(self.records)
+        schema = schemas.compile(schema)
+        several = len(schema.schemas) > 1
+        if reporter is None:
+            reporter = report.TextReporter(out)
         n_validated_entries = 0
-        journal_validator = abbrevs.Validator()
-
-
-        for key, value in iteritems(self.records):
-            type = value['type'].lower()
-            if type not in schema:
-                warner.warn('Schema does not have an entry for type={}'.format(type))
+        n_errors = 0
+        n_warnings = 0
+        if journal_validator is None:
+            journal_validator = abbrevs.Validator()
+
+        for key, value in records:
+            if cache is None:
+                result = check_record(value, schema, journal_validator)
             else:
-                required_items = schema[type].keys()
-                missing_items = set(required_items) - set([e.lower() for e in value.keys()])
-                # the line that this entry is on
-                line = next((i for i, l in enumerate(self.data.split(os.linesep)) if key in l))
-                for item in missing_items:
-                    print('\033[91mERROR: "{}" is missing field "{}" on line {}\033[0m'.format(key, item, line))
-                # if len(missing_items) > 0:
-                    # print value
-
-            if 'journal' in value:
-                recommendation = journal_validator.validate(value['journal'])
-                if recommendation is not None:
-                    msg = '\033[93mWARNING: Journal in {} (line {}), "{}" was not correct. Consider "{}"\033[0m'
-                    print(msg.format(key, line, value['journal'], recommendation))
-                    print()
-
+                digest = cache.key(value)
+                result = cache.get(digest)
+                if result is None:
+                    result = check_record(value, schema, journal_validator)
+                    cache.put(digest, result)
+
+            if result['missing'] is None:
+                reporter.report(report.Diagnostic('unknown-type', key, value.start_line,
+                                                  value=value.entry_type))
+            else:
+                for item, schema_names in result['missing']:
+                    # with several schemas, say which of them require the field
+                    reporter.report(report.Diagnostic('missing-field', key, value.start_line, item,
+                                                      schemas=schema_names if several else None))
+                    n_errors += 1
+
+            recommendation = result['journal']
+            if recommendation is not None:
+                reporter.report(report.Diagnostic('journal-abbreviation', key, value.lines.get('journal', value.start_line), 'journal',
+                                                  value['journal'], recommendation))
+                n_warnings += 1
 
             n_validated_entries += 1
+            if reporter.full:
+                break
 
-        print('Entries validated:', n_validated_entries)
-
-
-class Warner(object):
-    def __init__(self):
-        self._sent = set()
-
-    def warn(self, msg):
-        if msg not in self._sent:
-            print('Warning: {}'.format(msg))
-            self._sent.add(msg)
+        reporter.note('Entries validated: {}'.format(n_validated_entries))
+        if stats:
+            reporter.note('Journal lookups: {} hits, {} misses'.format(
+                journal_validator.hits, journal_validator.misses))
+            if cache is not None:
+                reporter.note('Cached results: {} reused, {} checked'.format(
+                    cache.hits, cache.misses))
+        counts = {'entries': n_validated_entries, 'errors': n_errors, 'warnings': n_warnings}
+        reporter.summary(counts)
+        return counts
+
+
+def json_item(record):
+    """Returns record as a dict of CSL-JSON-like fields: its fields, with the
+    entry type as 'type' and a type field as 'genre'"""
+    item = dict(record)
+    if 'type' in item:
+        item['genre'] = item.pop('type')
+    item['type'] = record.entry_type
+    return item
+
+
+def check_record(record, schema, journal_validator):
+    """Checks one record, independently of where it is in the file, against
+    schema, a schemas.SchemaSet.
+
+    Returns a dict with the [field, schema names] pairs of the fields the
+    schemas require but record lacks ('missing', None if no schema has an
+    entry for the record's type) and
+    the recommended abbreviation of its journal ('journal', None if it is
+    fine or absent).
+    """
+    missing_items = schema.missing(record)
+
+    recommendation = None
+    if 'journal' in record:
+        recommendation = journal_validator.validate(record['journal'])
+
+    return {'missing': missing_items, 'journal': recommendation}
+
+
+def _parse_entries(job):
+    """Parses a batch of entries in a worker process of iter_records"""
+    entries, hashtable, verbose = job
+    parser = Bibparser('', verbose=verbose)
+    parser.hashtable = hashtable
+    records = []
+    for line, text in entries:
+        records.extend(parser.parse_entry(line, text))
+    return records
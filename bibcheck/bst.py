@@ -22,12 +22,26 @@ THE SOFTWARE.
 from __future__ import print_function
 from __future__ import absolute_import
 
-#from __future__ import print_function, absolute_import
-import fileinput
+import multiprocessing
 import re
-import json
 import sys
+from collections import Counter, defaultdict
+from io import StringIO
+from time import perf_counter
 from . import bib
+from . import names
+
+# Bstparser compiles a .bst file to a Style: each FUNCTION is compiled
+# once, when it is defined, to a flat list of (opcode, argument)
+# instructions. Names are resolved to the builtin, the function or the
+# variable they stand for, and the {then} {else} if$ and {condition} {body}
+# while$ of the function body become jumps. An Interpreter runs the
+# commands of a Style on one bibliography, executing the instructions on
+# its own stack; the Style is never modified, so it can be shared.
+#
+# Tracing is off unless an Interpreter is given a Trace: it then runs
+# instructions with run_traced, a copy of run which counts them, instead
+# of run, so that run itself does no tracing work at all.
 
 def clear_comments(data):
     """Return the bibtex content without comments"""
@@ -38,474 +52,814 @@ def clear_comments(data):
     res = re.sub(r"(  )", " ", res)
     return res
 
-MAX_ITER = 100
-
-ENTRY = None
-
-STACK = []
-
-FUNCTIONS = {}
-
-BUFFER = ""
-
-VARIABLES = {}
-
-class Function :
-    OPS = {
-            ':=' : {
-                'arguments' : 2,
-                'function'  : 'assign'
-            },
-            '>' : {
-                'arguments' : 2,
-                'function'  : 'less'
-            },
-            '<' : {
-                'arguments' : 2,
-                'function'  : 'more'
-            },
-            '=' : {
-                'arguments' : 2,
-                'function'  : 'eq'
-            },
-            '+' : {
-                'arguments' : 2,
-                'function'  : 'iadd'
-            },
-            '-' : {
-                'arguments' : 2,
-                'function'  : 'isub'
-            },
-            '*' : {
-                'arguments' : 2,
-                'function'  : 'concat'
-            },
-            'pop$' : {
-                'arguments' : 0,
-                'function'  : 'pop'
-            },
-            "'skip$" : {
-                'arguments' : 0,
-                'function'  : 'skip'
-            },
-            "global.max$" : {
-                'arguments' : 0,
-                'function'  : 'global_max'
-            },
-            'if$' : {
-                'arguments' : 1,
-                'function'  : 'iff'
-            },
-            'while$'   : {
-                'arguments' : 2,
-                'function'  : '_while'
-            },
-            'swap$' : {
-                'arguments' : 2,
-                'function'  : 'swap'
-            },
-            'write$' : {
-                'arguments' : 1,
-                'function'  : 'write'
-            },
-            'newline$' : {
-                'arguments' : 0,
-                'function'  : 'newline'
-            },
-            'call.type$': {
-                'arguments' : 1,
-                'function' : 'call_type'
-            },
-            'preamble$' : {
-                'arguments' : 0,
-                'function'  : 'preample'
-            },
-            'add.period$' : {
-                'arguments' : 1,
-                'function'  : 'add_period'
-            },
-            'empty$' : {
-                'arguments' : 1,
-                'function'  : 'empty'
-            },
-            'missing$' :{
-                'arguments' : 1,
-                'function'  : 'missing',
-            },
-            'duplicate$' : {
-                'arguments' : 1,
-                'function'  : 'duplicate'
-            },
-            'substring$' : {
-                'arguments' : 3,
-                'function'  : 'substring'
-            },
-            'cite$' : {
-                'arguments' : 0,
-                'function'  : 'cite'
-            },
-            'int.to.str$'   : {
-                'arguments' : 1,
-                'function'  : 'int2str'
-            },
-            'width$'        : {
-                'arguments' : 0,
-                'function'  : 'width'
-            },
-            'num.names$'    : {
-                'arguments' : 1,
-                'function'  : 'num_names'
-            },
-            'format.name$'  : {
-                'arguments' : 3,
-                'function'  : 'format_names'
-            }
-
-        }
-
-    def __init__(self, name, commands, external_entries ):
-        self.name = name
-        self.commands = commands
-        self.external_entries = external_entries
-
-    def int2str( self, n ) :
-        global VARIABLES
-        n = self._lookup( n )
-        print(('int2str', n, VARIABLES))
-        self.push( str(n) )
-
-    def is_op( self, s ) :
-        global FUNCTIONS
-        global STACK
-
-        if s[0] == "'" and s[1:] in FUNCTIONS :
-            s = s[1:]
-            Function( s, FUNCTIONS[ s ], self.external_entries ).execute()
-            return {'arguments':1,'function':'push'}
-
-        if type(s) == type(()) :
-            return ( self.OPS[s[0]], s[1:] )
-
-        if s in self.OPS :
-            print((s, 'is op. executing.'))
-            return self.OPS[s]
-
-        if s in VARIABLES :
-            self.push( VARIABLES[s] )
-            return {'arguments':0,'function':'skip'}
-
-        if s in FUNCTIONS:
-            print((s, 'is function. executing.'))
-            Function( s, FUNCTIONS[ s ], self.external_entries ).execute()
-            return {'arguments':0,'function':'skip'}
-        print(("STACK: ", STACK))
-        return None
-
-    def format_names( self, s2, i, s1 ) :
-        name = s1.split(' and ')[ self._lookup(i)-1 ]
-        self.push( name )
-
-    def cite( self ):
-        global ENTRY
-        # should add the cite key
-        self.push( ENTRY['key'] )
+GLOBAL_MAX = 5000
 
-    def duplicate( self, a ) :
-        self.push( a )
-        self.push( a )
+ENTRY_MAX = 250
 
-    def global_max( self ) :
-        self.push( '#100' )
+# the pieces of output, write$ strings and newlines, passed on at once
+OUTPUT_CHUNK = 4096
 
-    def add_period( self, a ):
-        i = len(a) - 1
-        while i >= 0 :
-            print(('-', a[i]))
-            if a[i] != '}' :
-                break
-            i -= 1
+# opcodes
+PUSH, PUSH_FIELD, PUSH_LOCAL, PUSH_GLOBAL, STORE_LOCAL, STORE_GLOBAL, CALL, BUILTIN, JUMP, JUMP_FALSE = range(10)
 
-        if a[i] not in ['.','!','?','}'] :
-            self.push( a[:i+1] + '.' + a[i+1:] )
-        else :
-            self.push( a )
-
-    def missing( self, a ) :
-        global ENTRY
-        try :
-            ENTRY[a]
-            self.push('0')
-        except KeyError :
-            self.push('1')
-
-    def empty( self, a ):
-        print(('++++++++++++', a, a == ''))
-        if a == '' :
-            self.push('1')
-            print("----- 1")
-        else :
-            self.push('0')
-            print("----- 0")
-
-    def num_names( self, s ) :
-        self.push( s.count(' and ') + 1 )
-
-    def width( self ) :
-        self.push('#100')
-
-    def preample( self ) :
-        self.push('FU')
-
-    def write( self, a ) :
-        print(("writing", a))
-        global BUFFER
-        BUFFER += str(a)
-
-    def newline( self ) :
-        global BUFFER
-        BUFFER += "\n"
-
-    def swap( self, a, b ):
-        self.push(a)
-        self.push(b)
-
-    def substring( self, ln, start, s ) :
-        global STACK
-        l = len(s)
-        ln = self._lookup(ln)
-        start = self._lookup(start)
-        if start > 0 :
-            self.push( s[start-1:min(ln+start-1,l)] )
-        else :
-            self.push( s[:-start:-1] )
-        print(("STL:", STACK))
+OPNAMES = ('PUSH', 'PUSH_FIELD', 'PUSH_LOCAL', 'PUSH_GLOBAL', 'STORE_LOCAL', 'STORE_GLOBAL',
+           'CALL', 'BUILTIN', 'JUMP', 'JUMP_FALSE')
 
-    def iff( self, b, y, n ) :
-        if int(b) > 0 :
-            #Function( 'foo', y, self.external_entries ).execute()
-            self.execute_f(y)
-        else :
-            #Function( 'foo', n, self.external_entries ).execute()
-            self.execute_f(n)
+class Entry(object):
+    """A bibliography entry as the style sees it: its cite key, type, the
+    text of its fields, and its values of the entry variables"""
+    __slots__ = ('key', 'type', 'fields', 'vars')
 
-    def execute_f( self, f ) :
-        if type(f) == type([]) :
-            Function( 'unknon', f, self.external_entries ).execute()
-        else :
-            try :
-                Function( f, FUNCTIONS[f], self.external_entries ).execute()
-            except KeyError :
-                Function( f, [f], self.external_entries ).execute()
-
-    def skip(self):
-        pass
-
-    def fix_order( self, commands, cmd ) :
-
-        commands_res = []
-
-        for i, command in enumerate(commands) :
-            commands_res.append( command )
-            if command == cmd:
-                if type(commands[i-2]) == type([]) :
-                    f1 = self.fix_order(commands[i-2], cmd)
-                    print('f1')
-                else :
-                    f1 = commands[i-2]
-
-                if type(commands[i-i]) == type([]) :
-                    print('f2')
-                    f2 = self.fix_order(commands[i-1], cmd)
-                else :
-                    f2 = commands[i-1]
+    def __init__(self, key, type, fields, vars):
+        self.key = key
+        self.type = type
+        self.fields = fields
+        self.vars = vars
 
-                commands_res.pop()
-                commands_res.pop()
-                commands_res.pop()
-                commands_res.append( ( cmd, f1, f2 ) )
-
-        return commands_res
-
-    def execute( self, entry = None ):
-        global STACK
-        global ENTRY
-        print(("Executing commands", self.name))
-
-        print(("YO: ", self.commands))
-        commands = self.fix_order( self.commands, "if$" )
-        commands = self.fix_order( commands, "while$" )
-        print(("COMMANDS: ", commands))
-
-        #print 'BEFOR > ', self.commands
-        print((' > ', commands))
-        for command in commands :
-
-            print(('Executing command:', command))
-
-            try :
-                res = self.is_op( command )
-            except :
-                res = None
-
-            if res != None :
-
-                # gather all arguments
-                # and call function
-                args = []
-                # print "STACK", STACK
-                if type(res) == type(()) :
-                    f = getattr(self, res[0]['function'])
-
-                    if ( res[0]['function'] == 'iff' ) :
-                        args.append( self._lookup(self.pop()) )
-
-                    args.append(res[1][0])
-                    args.append(res[1][1])
-                else :
-                    for i in range(res['arguments']) :
-                        args.append(self.pop())
-                    f = getattr(self, res['function'])
-
-                if f :
-                    print(("AAA", args))
-                    f(*args)
-
-
-            elif command in [
-                    'volume',
-                    'title',
-                    'month',
-                    'year',
-                    'pages',
-                    'edition',
-                    'note',
-                    'key',
-                    'author',
-                    'volume',
-                    'number',
-                    'journal' ] :
-                try :
-                    self.push( ENTRY[ command ] )
-                except KeyError :
-                    self.push('')
-
-            elif type(command) == type([]) :
-                pass
-                #print '...', command
-                #Function( 'anon', command ).execute()
-                #self.execute_f( command )
-
-            elif re.match(r".*\$$", command):
-                pass
-                #print "TRALALA ", command
-
-            else :
-                if command[0] == '"' and command[-1] == '"' :
-                    command = command[1:-1]
-                #STACK.append(command)
-                self.push( command )
-
-        print("FINISHED EXECUTING %s" % self.name)
-        #print STACK
-
-    def assign( self, a, b ):
-        global VARIABLES
-        print(("AAAAA := ", a, b))
-        if len(b) > 0 and b[0] == '#' :
-            print("%s := %s" % ( a[1:], int(b[1:]) ))
-            VARIABLES[ a[1:] ] = int(b[1:])
-        else :
-            print("%s := %s" % ( a[1:], b ))
-            VARIABLES[ a[1:] ] = b
-
-    def less( self, a, b ):
-        print("%s < %s" % (a,b))
-        self.push( a < b and 1 or 0 )
-
-    def more( self, a, b ):
-        print("%s > %s" % (a,b))
-        self.push( a > b and 1 or 0 )
-
-    def eq( self, a, b ):
-        print("%s == %s" % (a,b))
-        self.push( a == b and 1 or 0 )
-
-    def concat( self, a, b ):
-        global VARIABLES
-        try :
-            a = VARIABLES[a[1:]]
-        except :
-            pass
-        try :
-            b = VARIABLES[b[1:]]
-        except :
-            pass
-        print("concat(%s,%s)" % (b,a))
-        self.push( str(b)+str(a) )
-
-    def isub( self, a, b ):
-        print("%s - %s" % (a,b))
-        a = self._lookup( a )
-        b = self._lookup( b )
-        self.push( b - a )
-
-    def iadd( self, a, b ):
-        a = self._lookup( a )
-        b = self._lookup( b )
-        print("%s + %s" % (a,b))
-        self.push( a + b )
-
-    def pop( self ):
-        global STACK
-        try :
-            res = STACK.pop()
-        except IndexError :
-            res = ""
-        print("poping: ", res)
-        return res
-
-    def push( self, item ):
-        global STACK
-        if type(item) == type(1) or item.isdigit() :
-            STACK.append( "#%s" % item )
-        else :
-            STACK.append( item )
-        print("pushing: ", STACK[-1])
+class Function(object):
+    """A compiled FUNCTION, or a {...} block pushed as a function literal"""
+    __slots__ = ('name', 'code')
 
-    def _lookup( self, s ) :
-        global VARIABLES
-
-        if type(s) == type("") and s[0] == '#' :
-            return int( s[1:] )
-        else :
-            try :
-                return VARIABLES[ s ]
-            except KeyError :
-                return s
-
-    def _while( self, a, b ) :
-        global STACK
-        print("WHILE")
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
 
-        i = 0
-        while True :
-            self.execute_f(a)
-            res = self._lookup( self.pop() )
-            if res == 0 :
-                break
-            self.execute_f(b)
-            i += 1
+    def __repr__(self):
+        return 'Function(%r)' % self.name
 
-            if i > MAX_ITER :
-                raise Exception( 'MAX_ITER' )
+class Variable(object):
+    """A quoted variable name, as pushed for :="""
+    __slots__ = ('name', 'local')
 
-MACROS = {}
+    def __init__(self, name, local):
+        self.name = name
+        self.local = local
+
+class Style(object):
+    """A compiled .bst style: its functions, the fields and variables it
+    declares, with their initial values, its macros, and its commands in
+    order, as (command, function literal) pairs.
+
+    A Style is not modified once compiled, so one Style can be used by any
+    number of Interpreters at once, in threads, or pickled to other
+    processes.
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self.fields = set(['crossref'])
+        self.entry_vars = {'sort.key$': ''}
+        self.variables = {}
+        self.macros = {}
+        self.commands = []
+
+class Trace(object):
+    """What an Interpreter given this Trace did: the instructions it ran,
+    by opcode, the calls of each builtin, and the calls and cumulative time
+    of each FUNCTION of the style, in seconds"""
+
+    def __init__(self):
+        self.ops = Counter()
+        # builtin function -> calls
+        self.builtins = Counter()
+        self.calls = Counter()
+        self.time = defaultdict(float)
+        # the functions being run, and how many times each, so that time
+        # spent in recursive calls is only counted once
+        self.active = Counter()
+
+    def update(self, other):
+        """Adds what another Trace recorded"""
+        self.ops.update(other.ops)
+        self.builtins.update(other.builtins)
+        self.calls.update(other.calls)
+        for name, t in other.time.items():
+            self.time[name] += t
+
+    def report(self, out=None, limit=None):
+        """Writes the functions by cumulative time, the limit first ones
+        only if given, then the builtins and opcodes by count, to out,
+        sys.stdout by default"""
+        out = sys.stdout if out is None else out
+        names = dict((f, name) for name, f in BUILTINS.items())
+        out.write('%10s %10s  %s\n' % ('calls', 'cumtime', 'function'))
+        functions = sorted(self.calls, key=lambda name: (-self.time[name], name))
+        for name in functions[:limit]:
+            out.write('%10d %10.4f  %s\n' % (self.calls[name], self.time[name], name))
+        out.write('\n%10s  %s\n' % ('calls', 'builtin'))
+        for f, n in self.builtins.most_common():
+            out.write('%10d  %s\n' % (n, names.get(f, getattr(f, '__name__', f))))
+        out.write('\n%10s  %s\n' % ('count', 'opcode'))
+        for op, n in self.ops.most_common():
+            out.write('%10d  %s\n' % (n, OPNAMES[op]))
+
+class Interpreter(object):
+    """The state of formatting one bibliography with a Style: the stack,
+    the global variables, the entries with their entry variables, and the
+    output not yet passed on, the pieces written by write$ and newline$.
+    warning$ messages are kept in warnings and, like those of top$
+    and stack$, written to log, sys.stderr by default.
+
+    With jobs > 1, ITERATE runs the functions which only depend on the
+    entry they format on batches of entries in a pool of that many
+    processes.
+
+    If trace, a Trace, is given, what the interpreter does is recorded in
+    it.
+    """
+
+    def __init__(self, style, log=None, jobs=1, trace=None):
+        self.style = style
+        self.log = sys.stderr if log is None else log
+        self.jobs = jobs
+        self.pool = None
+        self.trace = trace
+        if trace is not None:
+            # the code of each FUNCTION -> its name
+            self.traced = dict((id(f.code), name) for name, f in style.functions.items())
+            self.run = self.run_traced
+        self.stack = []
+        self.variables = dict(style.variables)
+        # the Entry being formatted, None in EXECUTE
+        self.entry = None
+        self.entries = []
+        self.output = []
+        self.warnings = []
+
+    def format(self, bib_data, out=None):
+        """Runs the commands of the style on the bibtex bib_data. Writes the
+        output to out, a text file object, as it is produced, or returns it
+        if out is None."""
+        chunks = self.iter_format(bib_data)
+        if out is None:
+            return ''.join(chunks)
+        for chunk in chunks:
+            out.write(chunk)
+
+    def iter_format(self, bib_data):
+        """Runs the commands of the style on the bibtex bib_data, yielding
+        the output in chunks of OUTPUT_CHUNK pieces or more as the entries
+        are formatted"""
+        try:
+            for _ in self.steps(bib_data):
+                if len(self.output) >= OUTPUT_CHUNK:
+                    yield self.take()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        if self.output:
+            yield self.take()
+
+    def take(self):
+        """Returns the output not passed on yet, and forgets it"""
+        text = ''.join(self.output)
+        self.output = []
+        return text
+
+    def steps(self, bib_data):
+        """Runs the commands of the style, yielding after each command and
+        each entry"""
+        for i, (command, f) in enumerate(self.style.commands):
+            if command == 'read':
+                self.read(bib_data)
+            elif command == 'execute':
+                self.entry = None
+                self.call(f)
+            elif command == 'iterate':
+                for _ in self.iterate(i, f):
+                    yield
+            elif command == 'reverse':
+                for _ in self.for_each(f, reversed(self.entries)):
+                    yield
+            elif command == 'sort':
+                self.entries.sort(key=lambda entry: entry.vars['sort.key$'])
+            yield
+
+    def read(self, bib_data):
+        parser = bib.Bibparser(bib_data)
+        parser.hashtable = dict(self.style.macros)
+        parser.parse()
+        fields = [(name, bib.RENAMED.get(name, name)) for name in self.style.fields]
+        entry_vars = self.style.entry_vars
+        self.entries = []
+        for key, record in parser.records.items():
+            self.entries.append(Entry(key, record.entry_type,
+                                      dict((name, record.text(k)) for name, k in fields if k in record),
+                                      dict(entry_vars)))
+
+    def iterate(self, i, f):
+        """Runs ITERATE {f}, the i-th command of the style, in parallel when
+        it can be, sequentially otherwise. Yields after each entry, or batch
+        of entries."""
+        if self.jobs > 1 and len(self.entries) > ITERATE_BATCH_SIZE and not self.stack:
+            functions = self.style.functions
+            types = set(entry.type if entry.type in functions else 'default.type' for entry in self.entries)
+            may_write = entry_local(f, [functions[type] for type in types if type in functions])
+            results = None if may_write is None else self.iterate_parallel(i, may_write)
+            if results is not None:
+                for batch, result in results:
+                    self.merge(batch, result, may_write)
+                    yield
+                return
+        for _ in self.for_each(f, self.entries):
+            yield
+
+    def iterate_parallel(self, i, may_write):
+        """Runs ITERATE on batches of the entries in self.pool. Returns the
+        (batch, result) pairs, or None if an entry left something on the
+        stack for the next one."""
+        variables = dict(self.variables)
+        for name in may_write:
+            variables[name] = _UNSET
+        batches = [self.entries[j:j + ITERATE_BATCH_SIZE]
+                   for j in range(0, len(self.entries), ITERATE_BATCH_SIZE)]
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.jobs, initializer=_init_worker, initargs=(self.style,))
+        traced = self.trace is not None
+        results = self.pool.map(_iterate_batch, [(i, variables, batch, traced) for batch in batches])
+        if any(result is None for result in results):
+            return None
+        return zip(batches, results)
+
+    def merge(self, batch, result, may_write):
+        """Takes over what a worker did formatting batch"""
+        output, log, warnings, entry_vars, variables, trace = result
+        self.output.extend(output)
+        if trace is not None:
+            self.trace.update(trace)
+        if log:
+            self.log.write(log)
+        self.warnings.extend(warnings)
+        for entry, vars in zip(batch, entry_vars):
+            entry.vars = vars
+        for name in may_write:
+            if variables[name] is not _UNSET:
+                self.variables[name] = variables[name]
+
+    def for_each(self, f, entries):
+        """Calls the function literal f for each of entries, yielding after
+        each"""
+        for entry in entries:
+            self.entry = entry
+            self.call(f)
+            yield
+        self.entry = None
+
+    def run(self, code):
+        """Executes compiled instructions"""
+        stack = self.stack
+        pc = 0
+        end = len(code)
+        while pc < end:
+            op, arg = code[pc]
+            pc += 1
+            if op == PUSH:
+                stack.append(arg)
+            elif op == BUILTIN:
+                arg(self)
+            elif op == CALL:
+                self.run(arg.code)
+            elif op == JUMP_FALSE:
+                if self.pop_int() <= 0:
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == PUSH_FIELD:
+                stack.append(self.entry.fields.get(arg))
+            elif op == PUSH_LOCAL:
+                stack.append(self.entry.vars[arg])
+            elif op == PUSH_GLOBAL:
+                stack.append(self.variables[arg])
+            elif op == STORE_LOCAL:
+                self.entry.vars[arg] = self.pop()
+            else:
+                self.variables[arg] = self.pop()
+
+    def run_traced(self, code):
+        """run, recording in self.trace the instructions run and, if code is
+        that of a FUNCTION, the call and the time it takes"""
+        trace = self.trace
+        name = self.traced.get(id(code))
+        if name is None:
+            return self.run_counted(code)
+        trace.calls[name] += 1
+        active = trace.active
+        active[name] += 1
+        start = perf_counter()
+        try:
+            self.run_counted(code)
+        finally:
+            active[name] -= 1
+            if not active[name]:
+                trace.time[name] += perf_counter() - start
+
+    def run_counted(self, code):
+        """The loop of run, counting the instructions"""
+        stack = self.stack
+        ops = self.trace.ops
+        builtins = self.trace.builtins
+        pc = 0
+        end = len(code)
+        while pc < end:
+            op, arg = code[pc]
+            pc += 1
+            ops[op] += 1
+            if op == PUSH:
+                stack.append(arg)
+            elif op == BUILTIN:
+                builtins[arg] += 1
+                arg(self)
+            elif op == CALL:
+                self.run(arg.code)
+            elif op == JUMP_FALSE:
+                if self.pop_int() <= 0:
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == PUSH_FIELD:
+                stack.append(self.entry.fields.get(arg))
+            elif op == PUSH_LOCAL:
+                stack.append(self.entry.vars[arg])
+            elif op == PUSH_GLOBAL:
+                stack.append(self.variables[arg])
+            elif op == STORE_LOCAL:
+                self.entry.vars[arg] = self.pop()
+            else:
+                self.variables[arg] = self.pop()
+
+    def call(self, f):
+        """Executes a function literal"""
+        if isinstance(f, Function):
+            self.run(f.code)
+        elif isinstance(f, Variable):
+            self.stack.append(self.entry.vars[f.name] if f.local else self.variables[f.name])
+        elif callable(f):
+            f(self)
+        else:
+            raise NameError("not a function: %r" % (f,))
+
+    def push(self, item):
+        self.stack.append(item)
+
+    def pop(self):
+        """Pops a literal, '' if the stack is empty"""
+        if self.stack:
+            return self.stack.pop()
+        return ''
+
+    def pop_int(self):
+        value = self.pop()
+        return value if isinstance(value, int) else 0
+
+    def pop_str(self):
+        """Pops a string; missing fields are empty"""
+        value = self.pop()
+        if value is None:
+            return ''
+        return value if isinstance(value, str) else str(value)
+
+# builtin functions
+
+def _assign(vm):
+    var = vm.pop()
+    value = vm.pop()
+    if not isinstance(var, Variable):
+        raise NameError(":= needs a quoted variable, got %r" % (var,))
+    if var.local:
+        vm.entry.vars[var.name] = value
+    else:
+        vm.variables[var.name] = value
+
+def _greater(vm):
+    b = vm.pop_int()
+    vm.push(1 if vm.pop_int() > b else 0)
+
+def _less(vm):
+    b = vm.pop_int()
+    vm.push(1 if vm.pop_int() < b else 0)
+
+def _equal(vm):
+    b = vm.pop()
+    vm.push(1 if vm.pop() == b else 0)
+
+def _add(vm):
+    b = vm.pop_int()
+    vm.push(vm.pop_int() + b)
+
+def _sub(vm):
+    b = vm.pop_int()
+    vm.push(vm.pop_int() - b)
+
+def _concat(vm):
+    b = vm.pop_str()
+    vm.push(vm.pop_str() + b)
+
+def _add_period(vm):
+    s = vm.pop_str()
+    t = s.rstrip('}')
+    if t and t[-1] not in '.?!':
+        s += '.'
+    vm.push(s)
+
+def _call_type(vm):
+    f = vm.style.functions.get(vm.entry.type) or vm.style.functions.get('default.type')
+    if f is not None:
+        vm.run(f.code)
+
+def change_case(s, spec):
+    """Converts s to title case ('t': lower case but for the first letter
+    and those after a colon and a space), lower case ('l') or upper case
+    ('u'), leaving brace groups alone"""
+    spec = spec[:1].lower()
+    out = []
+    depth = 0
+    keep = True
+    for c in s:
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            if spec == 'u':
+                c = c.upper()
+            elif spec == 'l' or (spec == 't' and not keep):
+                c = c.lower()
+        if depth == 0 and not c.isspace():
+            keep = c == ':'
+        out.append(c)
+    return ''.join(out)
+
+def _change_case(vm):
+    spec = vm.pop_str()
+    vm.push(change_case(vm.pop_str(), spec))
+
+def _chr_to_int(vm):
+    s = vm.pop_str()
+    vm.push(ord(s[0]) if len(s) == 1 else 0)
+
+def _cite(vm):
+    vm.push(vm.entry.key)
+
+def _duplicate(vm):
+    value = vm.pop()
+    vm.push(value)
+    vm.push(value)
+
+def _empty(vm):
+    value = vm.pop()
+    vm.push(1 if value is None or (isinstance(value, str) and not value.strip()) else 0)
+
+def _format_name(vm):
+    fmt = vm.pop_str()
+    i = vm.pop_int()
+    names_ = names.split_names(vm.pop_str())
+    vm.push(names.format_name(names_[i - 1], fmt) if 0 < i <= len(names_) else '')
+
+def _if(vm):
+    no = vm.pop()
+    yes = vm.pop()
+    vm.call(yes if vm.pop_int() > 0 else no)
+
+def _int_to_chr(vm):
+    vm.push(chr(vm.pop_int()))
+
+def _int_to_str(vm):
+    vm.push(str(vm.pop_int()))
+
+def _missing(vm):
+    vm.push(1 if vm.pop() is None else 0)
+
+def _newline(vm):
+    vm.output.append('\n')
+
+def _num_names(vm):
+    vm.push(len(names.split_names(vm.pop_str())))
+
+def _pop(vm):
+    vm.pop()
+
+def _preamble(vm):
+    vm.push('')
+
+_control_re = re.compile(r'\\([A-Za-z]+|.)')
+_purify_re = re.compile(r'[^\w\s]|_')
+
+def purify(s):
+    """Removes what is not a letter, digit or space from s, and the control
+    sequences, turning hyphens and ties into spaces"""
+    s = _control_re.sub('', s.replace('-', ' ').replace('~', ' '))
+    return _purify_re.sub('', s)
+
+def _purify(vm):
+    vm.push(purify(vm.pop_str()))
+
+def _quote(vm):
+    vm.push('"')
+
+def _skip(vm):
+    pass
+
+def _stack(vm):
+    while vm.stack:
+        vm.log.write('%r\n' % (vm.stack.pop(),))
+
+def _substring(vm):
+    length = vm.pop_int()
+    start = vm.pop_int()
+    s = vm.pop_str()
+    if start > 0:
+        vm.push(s[start - 1:start - 1 + length])
+    elif start < 0:
+        end = len(s) + start + 1
+        vm.push(s[max(end - length, 0):max(end, 0)])
+    else:
+        vm.push('')
+
+def _swap(vm):
+    b = vm.pop()
+    a = vm.pop()
+    vm.push(b)
+    vm.push(a)
+
+def _text_chars(s):
+    """Yields the offsets past each text character of s: a special
+    character, a brace group starting with a backslash, is one"""
+    depth = 0
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c == '{':
+            if depth == 0 and s[i + 1:i + 2] == '\\':
+                j = i
+                for j in range(i, len(s)):
+                    if s[j] == '{':
+                        depth += 1
+                    elif s[j] == '}':
+                        depth -= 1
+                        if depth == 0:
+                            break
+                depth = 0
+                i = j + 1
+                yield i
+                continue
+            depth += 1
+        elif c == '}':
+            depth = max(depth - 1, 0)
+        else:
+            yield i + 1
+        i += 1
+
+def _text_length(vm):
+    vm.push(sum(1 for _ in _text_chars(vm.pop_str())))
+
+def _text_prefix(vm):
+    n = vm.pop_int()
+    s = vm.pop_str()
+    end = 0
+    for i, end in enumerate(_text_chars(s)):
+        if i + 1 == n:
+            break
+    else:
+        if n <= 0:
+            end = 0
+    prefix = s[:end] if n > 0 else ''
+    vm.push(prefix + '}' * max(prefix.count('{') - prefix.count('}'), 0))
+
+def _top(vm):
+    vm.log.write('%r\n' % (vm.pop(),))
+
+def _type(vm):
+    vm.push(vm.entry.type if vm.entry is not None else '')
+
+def _warning(vm):
+    message = vm.pop_str()
+    vm.warnings.append(message)
+    vm.log.write('Warning--%s\n' % message)
+
+def _while(vm):
+    body = vm.pop()
+    condition = vm.pop()
+    while True:
+        vm.call(condition)
+        if vm.pop_int() <= 0:
+            break
+        vm.call(body)
+
+# widths of the cmr10 characters, in hundredths of a point, as BibTeX has
+_WIDTHS = dict(zip(
+    ' abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789',
+    [278, 500, 556, 444, 556, 444, 306, 500, 556, 278, 306, 528, 278, 833, 556, 500, 556, 528, 392, 394,
+     389, 556, 528, 722, 528, 528, 444, 750, 708, 722, 764, 681, 653, 785, 750, 361, 514, 778, 625, 917,
+     750, 778, 681, 778, 736, 556, 722, 750, 750, 1028, 750, 750, 611] + [500] * 10))
+
+def _width(vm):
+    vm.push(sum(_WIDTHS.get(c, 500) for c in vm.pop_str() if c not in '{}'))
+
+def _write(vm):
+    vm.output.append(vm.pop_str())
+
+BUILTINS = {
+    ':=': _assign,
+    '>': _greater,
+    '<': _less,
+    '=': _equal,
+    '+': _add,
+    '-': _sub,
+    '*': _concat,
+    'add.period$': _add_period,
+    'call.type$': _call_type,
+    'change.case$': _change_case,
+    'chr.to.int$': _chr_to_int,
+    'cite$': _cite,
+    'duplicate$': _duplicate,
+    'empty$': _empty,
+    'format.name$': _format_name,
+    'if$': _if,
+    'int.to.chr$': _int_to_chr,
+    'int.to.str$': _int_to_str,
+    'missing$': _missing,
+    'newline$': _newline,
+    'num.names$': _num_names,
+    'pop$': _pop,
+    'preamble$': _preamble,
+    'purify$': _purify,
+    'quote$': _quote,
+    'skip$': _skip,
+    'stack$': _stack,
+    'substring$': _substring,
+    'swap$': _swap,
+    'text.length$': _text_length,
+    'text.prefix$': _text_prefix,
+    'top$': _top,
+    'type$': _type,
+    'warning$': _warning,
+    'while$': _while,
+    'width$': _width,
+    'write$': _write,
+}
+
+# builtin integer constants
+CONSTANTS = {
+    'global.max$': GLOBAL_MAX,
+    'entry.max$': ENTRY_MAX,
+}
+
+_int_re = re.compile(r'#[+-]?\d+$')
+
+# Parallel ITERATE. The function can run on batches of entries in other
+# processes if the order of the entries cannot change what it does: the
+# global variables it may read before writing them are ones it never
+# writes. Each worker starts from the globals at the ITERATE, those the
+# function may write set to _UNSET, and the results are merged in order.
+
+ITERATE_BATCH_SIZE = 100
+
+class _Unset(object):
+    """The value of the globals a worker has not written"""
+    def __reduce__(self):
+        # unpickled as the same object
+        return '_UNSET'
+
+_UNSET = _Unset()
+
+_NOTHING = frozenset()
+
+def _flow(code, types, memo):
+    """Returns the (reads, writes, may_write) global variables of code: those
+    it may read before writing them, those it writes whatever path it takes,
+    and those it may write. types are the functions call.type$ may call."""
+    n = len(code)
+    effects = [_effect(op, arg, types, memo) for op, arg in code]
+    # the globals written on every path to each instruction, None if the
+    # instruction is not reached
+    written = [None] * (n + 1)
+    written[0] = _NOTHING
+    work = [0]
+    while work:
+        pc = work.pop()
+        if pc == n:
+            continue
+        op, arg = code[pc]
+        out = written[pc] | effects[pc][1]
+        if op == JUMP:
+            targets = (arg,)
+        elif op == JUMP_FALSE:
+            targets = (pc + 1, arg)
+        else:
+            targets = (pc + 1,)
+        for target in targets:
+            old = written[target]
+            new = out if old is None else old & out
+            if new != old:
+                written[target] = new
+                work.append(target)
+    reads = set()
+    may_write = set()
+    for pc in range(n):
+        if written[pc] is not None:
+            reads |= effects[pc][0] - written[pc]
+            may_write |= effects[pc][2]
+    return frozenset(reads), written[n] or _NOTHING, frozenset(may_write)
+
+def _types_flow(types, memo):
+    """Returns the _flow of call.type$: any of the functions types"""
+    flows = [_function_flow(f, types, memo) for f in types]
+    if not flows:
+        return _NOTHING, _NOTHING, _NOTHING
+    return (frozenset().union(*[flow[0] for flow in flows]),
+            frozenset.intersection(*[flow[1] for flow in flows]),
+            frozenset().union(*[flow[2] for flow in flows]))
+
+def _function_flow(f, types, memo):
+    if f not in memo:
+        memo[f] = None
+        memo[f] = _flow(f.code, types, memo)
+    elif memo[f] is None:
+        # calls itself: assume the worst
+        return frozenset(['*']), _NOTHING, frozenset(['*'])
+    return memo[f]
+
+def _literal_flow(f, types, memo):
+    """Returns the _flow of calling the function literal f"""
+    if isinstance(f, Function):
+        return _function_flow(f, types, memo)
+    if isinstance(f, Variable):
+        # pushed for :=, or to be called: reads and writes the variable
+        if f.local:
+            return _NOTHING, _NOTHING, _NOTHING
+        return frozenset([f.name]), _NOTHING, frozenset([f.name])
+    if f is _call_type:
+        return _types_flow(types, memo)
+    return _NOTHING, _NOTHING, _NOTHING
+
+def _effect(op, arg, types, memo):
+    if op == PUSH_GLOBAL:
+        return frozenset([arg]), _NOTHING, _NOTHING
+    if op == STORE_GLOBAL:
+        return _NOTHING, frozenset([arg]), frozenset([arg])
+    if op == CALL:
+        return _function_flow(arg, types, memo)
+    if op == BUILTIN and arg is _call_type:
+        return _types_flow(types, memo)
+    if op == PUSH:
+        # a literal may be called later by if$, while$ or :=, when more
+        # may have been written, but it may also not be called
+        reads, writes, may_write = _literal_flow(arg, types, memo)
+        return reads, _NOTHING, may_write
+    return _NOTHING, _NOTHING, _NOTHING
+
+def entry_local(f, types):
+    """Tells whether ITERATE {f} can run on the entries in any order. types
+    are the functions call.type$ may call. Returns the globals f may write,
+    or None if it may read what another entry wrote."""
+    reads, writes, may_write = _literal_flow(f, types, {})
+    if reads & may_write:
+        return None
+    return may_write
+
+# the style of a worker process of Interpreter.iterate_parallel
+_worker_style = None
+
+def _init_worker(style):
+    global _worker_style
+    _worker_style = style
+
+def _iterate_batch(job):
+    """Runs the i-th command of the style, an ITERATE, on a batch of entries
+    in a worker process. Returns the pieces of output, the log, the warnings, the
+    entry variables of each entry, the globals and the Trace if traced, or
+    None if an entry left something on the stack."""
+    i, variables, entries, traced = job
+    vm = Interpreter(_worker_style, log=StringIO(), trace=Trace() if traced else None)
+    vm.variables = variables
+    f = _worker_style.commands[i][1]
+    for entry in entries:
+        vm.entry = entry
+        vm.call(f)
+        if vm.stack:
+            return None
+    return vm.output, vm.log.getvalue(), vm.warnings, [entry.vars for entry in entries], vm.variables, vm.trace
+
+def compile(bst_data):
+    """Returns the Style of the text of a .bst file"""
+    parser = Bstparser(bst_data)
+    parser.parse()
+    return parser.style
+
+def format_bibliography(style, bib_data, jobs=1, out=None, trace=None):
+    """Formats the bibtex bib_data with style, a Style. Writes the output to
+    out, a text file object, or returns it if out is None."""
+    return Interpreter(style, jobs=jobs, trace=trace).format(bib_data, out)
 
 class Bstparser :
     def tokenize(self) :
         """Returns a token iterator"""
         for item in self.token_re.finditer(self.data):
             i = item.group(0)
+            if i[0] == '%' :
+                continue
             if self.white.match(i) :
                 if self.nl.match(i) :
                     self.line += 1
@@ -513,27 +867,29 @@ class Bstparser :
             else :
                 yield i
 
-    def __init__(self, bst_data, bib_data) :
+    def __init__(self, bst_data, bib_data=None, jobs=1, out=None, trace=None) :
         self.data = bst_data
         self.token = None
         self.token_type = None
-        self._next_token = self.tokenize().next
         self.hashtable = {}
         self.mode = None
         self.records = {}
         self.line = 1
         self.last_called_function = None
         self.bib_data = bib_data
-
-        tmp = bib.Bibparser( bib_data )
-        tmp.parse()
+        self.jobs = jobs
+        self.out = out
+        self.trace = trace
+        self.style = Style()
+        # set by parse when there is bib_data, and no out to write it to
+        self.output = None
+        self.entries = []
 
         # compile some regexes
         self.white = re.compile(r"[\n|\s]+")
         self.nl = re.compile(r"[\n]")
-        self.token_re = re.compile(r"([^\s\"%(){}@,]+|#\d+|:=|\n|@|\"[^\"]*\"|{|}|=|,)")
-
-        # integer variables list
+        self.token_re = re.compile(r"(%[^\n]*|[^\s\"%(){}@,]+|#\d+|:=|\n|@|\"[^\"]*\"|{|}|=|,)")
+        self._next_token = self.tokenize().__next__
         self.integer_list = []
 
     def next_token(self):
@@ -541,7 +897,9 @@ class Bstparser :
         self.token = self._next_token()
 
     def parse(self) :
-        """Parses self.data and stores the parsed bibtex to self.rec"""
+        """Compiles self.data to self.style, and formats self.bib_data with
+        it if given, setting self.entries, and self.output unless the output
+        is written to self.out"""
         while True :
             try :
                 self.next_token()
@@ -572,147 +930,59 @@ class Bstparser :
             except StopIteration :
                 break
 
+        if self.bib_data is not None :
+            interpreter = Interpreter(self.style, jobs=self.jobs, trace=self.trace)
+            self.output = interpreter.format(self.bib_data, self.out)
+            self.entries = interpreter.entries
+
     def eat_except( self, s ):
         while True:
             if self.token == s :
                 break;
-            #print self.token
             self.next_token()
 
-    def push( self, item ):
-        global STACK
-        if type(item) == type(1) or item.isdigit() :
-            STACK.append( "#%s" % item )
-        else :
-            STACK.append( item )
-        print("pushing: ", STACK[-1])
-
-    def pop( self ):
-        global STACK
-        try :
-            res = STACK.pop()
-        except IndexError :
-            res = ""
-        print("poping: ", res)
-        return res
-
-    def entry(self):
+    def names(self):
+        """Returns the names of a {...} list"""
         self.next_token()
-        if self.token == '{' :
-
+        if self.token != '{' :
+            raise NameError("{ expected")
+        res = []
+        self.next_token()
+        while self.token != '}' :
+            res.append(self.token.lower())
             self.next_token()
+        return res
 
-            # get external entries
-            external_entries = {}
-            while True:
-                if self.token == '}' :
-                    break;
-                external_entries[ self.token ] = True
-                self.next_token()
-
-            if self.token == '}' :
-                self.next_token()
-                if self.token == '{' :
-                    self.next_token()
-
-                    # get internal integers
-                    internal_ints = {}
-                    while True:
-                        if self.token == '}' :
-                            break;
-                        internal_ints[ self.token ] = True
-                        self.next_token()
-
-                    if self.token == '}' :
-                        self.next_token()
-                        if self.token == '{' :
-                            self.next_token()
-
-                            # get internal string
-                            internal_str = {}
-                            while True:
-                                if self.token == '}' :
-                                    break;
-                                internal_str[ self.token ] = True
-                                self.next_token()
-
-                            if self.token == '}' :
-
-                                self.external_entries = external_entries
-                                self.internal_ints = internal_ints
-                                self.internal_str = internal_str
-
-                                return
-                            else :
-                                raise NameError("} expected 6")
-                        else:
-                            raise NameError("{ expected 5")
-                    else:
-                        raise NameError("} expected 4")
-                else :
-                    raise NameError("{ expected 3")
-            else :
-                raise NameError("} expected 2")
-        else :
-            raise NameError("{ expected 1")
+    def entry(self):
+        fields = self.names()
+        ints = self.names()
+        strs = self.names()
+        self.style.fields.update(fields)
+        for name in ints:
+            self.style.entry_vars[name] = 0
+        for name in strs:
+            self.style.entry_vars[name] = ''
 
     def integers(self):
-        self.integer_list = []
-        self.next_token()
-        if self.token == '{' :
-            self.next_token()
-
-            while True :
-                if self.token == '}' :
-                    break
-                self.integer_list.append(self.token)
-                self.next_token()
-            print("INTEGERS", self.integer_list)
-        else :
-            raise NameError("{ expected 2")
+        self.integer_list = self.names()
+        for name in self.integer_list:
+            self.style.variables[name] = 0
 
     def function(self):
-        global FUNCTIONS
-        global STACK
-
         self.next_token()
         if self.token == '{' :
             self.next_token()
 
             # Get name
-            name = self.token
+            name = self.token.lower()
             self.next_token()
 
             if self.token == '}' :
                 self.next_token()
-                bracket = 0
                 if self.token == '{' :
                     self.next_token()
-
-                    # NEED TO HAVE NESTED COMMANDS
-                    commands = []
-
-                    while True :
-                        #print '+++++', self.token
-                        if self.token == '{' :
-                            res = self.command()
-                            #print "AAAA", res
-                            #for c in res :
-                            #    STACK.append(c)
-                            #commands.append( res[0:] )
-                            commands += res
-                        else :
-                            commands.append( self.token )
-                            self.next_token()
-                        if self.token == '}' :
-                            break
-
-                    #print "YO",commands
-                    if self.token == '}':
-                        FUNCTIONS[ name ] = commands
-                        return
-                    else:
-                        raise NameError("} expected 4")
+                    self.style.functions[ name ] = Function(name, self.compile(self.block()))
+                    return
                 else :
                     raise NameError("{ expected 3")
             else :
@@ -720,22 +990,125 @@ class Bstparser :
         else :
             raise NameError("{ expected 1")
 
-    def command( self, depth = 0 ) :
-        cmd = []
-        while True :
-            #print "----", self.token
-
+    def block(self):
+        """Returns the tokens up to the closing brace, with the nested
+        blocks as lists"""
+        res = []
+        while self.token != '}' :
             if self.token == '{' :
                 self.next_token()
-                res = self.command(depth+1)
-                cmd.append( res )
-            elif self.token == '}' :
-                if depth > 0 :
-                    self.next_token()
-                return cmd
+                res.append(self.block())
             else :
-                cmd.append( self.token )
-                self.next_token()
+                res.append(self.token)
+            self.next_token()
+        return res
+
+    def compile(self, block, code=None):
+        """Returns the instructions of the tokens of block, appended to
+        code if given"""
+        if code is None :
+            code = []
+        for node in self.group(block):
+            self.emit(node, code)
+        return code
+
+    def group(self, block):
+        """Returns the tokens of block, with the operands of if$ and while$
+        grouped with them in (name, operand, operand) tuples, and those of :=
+        in (':=', variable) tuples when they are literal"""
+        nodes = []
+        for item in block:
+            if isinstance(item, str) and item.lower() in ('if$', 'while$') and len(nodes) >= 2 \
+                    and self.is_operand(nodes[-2]) and self.is_operand(nodes[-1]) :
+                b = nodes.pop()
+                a = nodes.pop()
+                nodes.append((item.lower(), a, b))
+            elif item == ':=' and nodes and self.is_operand(nodes[-1]) \
+                    and not isinstance(nodes[-1], list) and self.is_variable(nodes[-1][1:].lower()) :
+                nodes.append((':=', nodes.pop()[1:].lower()))
+            else :
+                nodes.append(item)
+        return nodes
+
+    def is_operand(self, node):
+        return isinstance(node, list) or (isinstance(node, str) and node[0] == "'")
+
+    def is_variable(self, name):
+        return name in self.style.entry_vars or name in self.style.variables
+
+    def emit(self, node, code):
+        """Appends the instructions of one node of compile to code"""
+        if isinstance(node, list) :
+            code.append((PUSH, Function('{}', self.compile(node))))
+        elif isinstance(node, tuple) :
+            if node[0] == ':=' :
+                code.append((STORE_LOCAL if node[1] in self.style.entry_vars else STORE_GLOBAL, node[1]))
+            elif node[0] == 'if$' :
+                # condition, jump to the else branch if false
+                jump = len(code)
+                code.append((JUMP_FALSE, None))
+                self.emit_operand(node[1], code)
+                if self.emit_operand(node[2], []) :
+                    skip = len(code)
+                    code.append((JUMP, None))
+                    code[jump] = (JUMP_FALSE, len(code))
+                    self.emit_operand(node[2], code)
+                    code[skip] = (JUMP, len(code))
+                else :
+                    code[jump] = (JUMP_FALSE, len(code))
+            else :
+                start = len(code)
+                self.emit_operand(node[1], code)
+                jump = len(code)
+                code.append((JUMP_FALSE, None))
+                self.emit_operand(node[2], code)
+                code.append((JUMP, start))
+                code[jump] = (JUMP_FALSE, len(code))
+        elif node[0] == '"' :
+            code.append((PUSH, node[1:-1]))
+        elif _int_re.match(node) :
+            code.append((PUSH, int(node[1:])))
+        elif node[0] == "'" :
+            code.append((PUSH, self.literal(node[1:].lower())))
+        else :
+            self.emit_name(node.lower(), code)
+
+    def emit_operand(self, node, code):
+        """Appends the instructions running an operand of if$ or while$ to
+        code. Returns code."""
+        if isinstance(node, list) :
+            # jump targets are offsets in code, so compile in place
+            self.compile(node, code)
+        else :
+            self.emit_name(node[1:].lower(), code)
+        return code
+
+    def emit_name(self, name, code):
+        if name in self.style.functions :
+            code.append((CALL, self.style.functions[name]))
+        elif name in BUILTINS :
+            if name != 'skip$' :
+                code.append((BUILTIN, BUILTINS[name]))
+        elif name in self.style.fields :
+            code.append((PUSH_FIELD, name))
+        elif name in self.style.entry_vars :
+            code.append((PUSH_LOCAL, name))
+        elif name in self.style.variables :
+            code.append((PUSH_GLOBAL, name))
+        elif name in CONSTANTS :
+            code.append((PUSH, CONSTANTS[name]))
+        else :
+            raise NameError("unknown function %s" % name)
+
+    def literal(self, name):
+        """Returns the function literal of a quoted name"""
+        if name in self.style.functions :
+            return self.style.functions[name]
+        if name in BUILTINS :
+            return BUILTINS[name]
+        if self.is_variable(name) :
+            return Variable(name, name in self.style.entry_vars)
+        return Function(name, self.emit_operand("'" + name, []))
 
     def string( self ) :
         s = ''
@@ -752,14 +1125,11 @@ class Bstparser :
                 return s
 
     def macro(self):
-        global MACROS
-
         self.next_token()
         if self.token == '{' :
             self.next_token()
 
             # Get name
-            #print "MACRO", self.token
             name = self.token
             self.next_token()
 
@@ -782,7 +1152,7 @@ class Bstparser :
                         self.next_token()
 
                     if self.token == '}' and bracket == 0:
-                        MACROS[ name ] = ' '.join(val)
+                        self.style.macros[ name ] = ' '.join(val).strip('"')
                         return
                     else:
                         raise NameError("} expected 4")
@@ -797,95 +1167,35 @@ class Bstparser :
         self.next_token()
         if self.token == '{' :
             self.next_token()
-
-            # Get name
-            print("EXECUTE", self.token)
-            f = self.token
-            Function( f, FUNCTIONS[ f ], self.external_entries ).execute()
-
+            self.style.commands.append(('execute', self.literal(self.token.lower())))
             self.eat_except('}') ###
         else :
             raise NameError("{ expected 2")
 
     def read(self):
-        self.bib = bib.Bibparser(self.bib_data)
-        self.bib.parse()
-        pass
+        self.style.commands.append(('read', None))
 
     def reverse(self):
         self.next_token()
         if self.token == '{' :
             self.next_token()
+            self.style.commands.append(('reverse', self.literal(self.token.lower())))
             self.eat_except('}') ###
         else :
             raise NameError("{ expected 2")
 
     def sort(self):
-        self.next_token()
-        if self.token == '{' :
-            self.next_token()
-            self.eat_except('}') ###
-        else :
-            raise NameError("{ expected 2")
+        self.style.commands.append(('sort', None))
 
     def iterate(self):
-        global ENTRY
         self.next_token()
         if self.token == '{' :
             self.next_token()
-
-            func = self.token
-
-            for entry in self.bib.records:
-                ENTRY = self.bib.records[entry]
-                # Execute func for
-                # the specific entity
-                if func == 'call.type$' :
-                    #print "\t call.type$", entry
-                    func = self.bib.records[entry]['record_type']
-                Function( func, FUNCTIONS[ func ], self.external_entries ).execute( self.bib.records[entry] )
-
+            self.style.commands.append(('iterate', self.literal(self.token.lower())))
             self.eat_except('}') ###
         else :
             raise NameError("{ expected 2")
 
     def strings(self):
-        integer_list = []
-        self.next_token()
-        if self.token == '{' :
-            self.next_token()
-
-            while True :
-                if self.token == '}' :
-                    break
-                integer_list.append(self.token)
-                self.next_token()
-            #print "STRINGS", integer_list
-        else :
-            raise NameError("{ expected 2")
-
-# def main() :
-#     """Main function"""
-#
-#     _bst_filename = sys.argv[1]
-#     _bib_filename = sys.argv[2]
-#
-#     with open( _bst_filename, 'r' ) as f :
-#         bst_file_data = f.read()
-#
-#     with open( _bib_filename, 'r' ) as f :
-#         bib_file_data = f.read()
-#
-#     bst_file_data = clear_comments(bst_file_data)
-#     bib_file_data = clear_comments(bib_file_data)
-#
-#     bst = Bstparser(bst_file_data, bib_file_data)
-#     bst.parse()
-#
-#     print "------"
-#     print
-#     print STACK
-#     print BUFFER
-#
-# if __name__ == "__main__" :
-#     main()
+        for name in self.names():
+            self.style.variables[name] = ''
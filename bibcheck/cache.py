@@ -0,0 +1,97 @@
+"""On-disk cache of validation results, so that re-running bibcheck on a
+bibliography where only a few entries changed only checks those entries.
+
+Each .bib file gets its own cache file, mapping a digest of every record
+(its entry type and parsed fields, the schema and the abbreviation table
+version) to the result of bib.check_record for it. A cache written by
+another version of bibcheck is ignored.
+"""
+from __future__ import absolute_import
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+from . import __version__
+
+CACHE_FORMAT = 4
+
+# python 2 has no os.replace; its os.rename replaces the target on POSIX
+_replace = getattr(os, 'replace', os.rename)
+
+
+def default_cache_dir():
+    """Returns $XDG_CACHE_HOME/bibcheck, or ~/.cache/bibcheck"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bibcheck')
+
+
+def cache_path(cache_dir, bibtex):
+    """Returns the cache file for the .bib file bibtex"""
+    name = hashlib.sha1(os.path.abspath(bibtex).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, name + '.json')
+
+
+def clear(cache_dir):
+    """Removes the cache files in cache_dir"""
+    for fn in glob.glob(os.path.join(cache_dir, '*.json')):
+        os.remove(fn)
+
+
+class ResultCache(object):
+    def __init__(self, path, schema, table_version):
+        self.path = path
+        self.salt = json.dumps([schema.definition, table_version], sort_keys=True)
+        self.results = {}
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('format') == CACHE_FORMAT and data.get('version') == __version__:
+            self.results = data.get('results', {})
+
+    def key(self, record):
+        """Returns the digest identifying record's result"""
+        normalized = self.salt + json.dumps([record.entry_type, record.raw()], sort_keys=True, default=dict)
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached result for key, or None"""
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used[key] = result
+        return result
+
+    def put(self, key, result):
+        self.used[key] = result
+
+    def save(self):
+        """Writes the results used since loading, dropping those of entries
+        which are gone"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # made by another run in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        # each run writes its own temporary file, so that runs saving at the
+        # same time do not clobber each other's; the last one replaces the
+        # cache file whole
+        fd, tmp = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(self.path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'format': CACHE_FORMAT, 'version': __version__, 'results': self.used}, f)
+            _replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
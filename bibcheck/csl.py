@@ -0,0 +1,272 @@
+"""Export of parsed records as CSL-JSON.
+
+    bibcheck export [-o items.json] file.bib ...
+
+item() renames the bibtex fields and entry types to their CSL names,
+leaving out the fields CSL has no variable for. Values are taken from the
+text of the fields as written, with LaTeX accents and special letters
+turned into Unicode and braces removed (plain_text). dump() writes an
+array of items to a file object one record at a time, so a bibliography
+is never held in memory whole. Items are serialized with orjson when it
+is installed, and with the json module otherwise; both give the same
+text.
+"""
+from __future__ import print_function, absolute_import
+import json
+import re
+import sys
+import unicodedata
+from argparse import ArgumentParser
+
+from . import bib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ('json', 'orjson')
+
+# bibtex entry type -> CSL type
+TYPES = {
+    'article': 'article-journal',
+    'book': 'book',
+    'booklet': 'pamphlet',
+    'collection': 'book',
+    'inbook': 'chapter',
+    'incollection': 'chapter',
+    'inproceedings': 'paper-conference',
+    'conference': 'paper-conference',
+    'proceedings': 'book',
+    'manual': 'report',
+    'mastersthesis': 'thesis',
+    'phdthesis': 'thesis',
+    'thesis': 'thesis',
+    'techreport': 'report',
+    'report': 'report',
+    'online': 'webpage',
+    'patent': 'patent',
+    'unpublished': 'manuscript',
+    'misc': 'document',
+}
+
+# bibtex field -> CSL variable, for the fields kept as they are
+VARIABLES = {
+    'title': 'title',
+    'journal': 'container-title',
+    'journaltitle': 'container-title',
+    'booktitle': 'container-title',
+    'series': 'collection-title',
+    'volume': 'volume',
+    'edition': 'edition',
+    'chapter': 'chapter-number',
+    'page': 'page',
+    'publisher': 'publisher',
+    'institution': 'publisher',
+    'school': 'publisher',
+    'organization': 'publisher',
+    'address': 'publisher-place',
+    'location': 'publisher-place',
+    'doi': 'DOI',
+    'url': 'URL',
+    'isbn': 'ISBN',
+    'issn': 'ISSN',
+    'type': 'genre',
+    'note': 'note',
+    'abstract': 'abstract',
+    'keywords': 'keyword',
+    'language': 'language',
+}
+
+# bibtex fields holding names, which only the author field has parsed
+NAMES = {
+    'author': 'author',
+    'editor': 'editor',
+    'translator': 'translator',
+}
+
+# LaTeX accents -> Unicode combining characters
+ACCENTS = {
+    "'": '\u0301', '`': '\u0300', '^': '\u0302', '"': '\u0308', '~': '\u0303',
+    '=': '\u0304', '.': '\u0307', 'u': '\u0306', 'v': '\u030c', 'H': '\u030b',
+    'c': '\u0327', 'k': '\u0328', 'r': '\u030a', 'd': '\u0323', 'b': '\u0331',
+}
+
+# control sequences standing for letters
+LETTERS = {
+    'i': '\u0131', 'j': '\u0237', 'l': '\u0142', 'L': '\u0141', 'o': '\u00f8', 'O': '\u00d8',
+    'ae': '\u00e6', 'AE': '\u00c6', 'oe': '\u0153', 'OE': '\u0152', 'aa': '\u00e5', 'AA': '\u00c5',
+    'ss': '\u00df',
+}
+
+# control sequences which only change the font, and are dropped
+FONTS = set([
+    'em', 'it', 'sl', 'sc', 'bf', 'rm', 'sf', 'tt', 'cal', 'emph', 'textit', 'textsl', 'textsc',
+    'textbf', 'textrm', 'textsf', 'texttt', 'mathrm', 'mathit', 'mathbf', 'mathcal', 'mbox',
+    'relax', 'protect',
+])
+
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+
+_date_re = re.compile(r'(\d{1,4})(?:-(\d\d?))?(?:-(\d\d?))?$')
+
+# an accent, then the letter it is on, braced or not
+_accent_re = re.compile(r'\\(?:([\'`^"~=.])|([uvHckrdb])(?![A-Za-z]))\s*'
+                        r'(?:\{\s*(\\[A-Za-z]+|[A-Za-z])?\s*\}|(\\[A-Za-z]+|[A-Za-z]))')
+_unbraced_accent_re = re.compile(r'(?<!\{)' + _accent_re.pattern)
+_command_re = re.compile(r'\\([A-Za-z]+)\s*|\\([^A-Za-z])')
+
+
+def _accent(match):
+    base = match.group(3) or match.group(4) or ''
+    if base.startswith('\\'):
+        # the dotless i and j take the accents of i and j
+        base = {'\\i': 'i', '\\j': 'j'}.get(base) or LETTERS.get(base[1:], base[1:])
+    return unicodedata.normalize('NFC', base + ACCENTS[match.group(1) or match.group(2)])
+
+
+def _command(match):
+    name = match.group(1)
+    if name is None:
+        # \& and the like; \\ breaks a line, \- a word
+        return {'\\': ' ', '-': ''}.get(match.group(2), match.group(2))
+    if name in LETTERS:
+        return LETTERS[name]
+    if name in FONTS:
+        return ''
+    # \log, \alpha...: their name is as close as plain text gets
+    return name + ' '
+
+
+def plain_text(text):
+    """Returns the bibtex text as plain Unicode text: LaTeX accents and
+    special letters are converted, font commands, braces and $ dropped,
+    ties, dashes and whitespace turned into their plain counterparts"""
+    if '\\' in text:
+        text = _accent_re.sub(_accent, text)
+        text = _command_re.sub(_command, text)
+    text = text.replace('---', '\u2014').replace('--', '\u2013').replace('~', ' ')
+    text = text.replace('{', '').replace('}', '').replace('$', '')
+    return ' '.join(text.split())
+
+
+def issued(record):
+    """Returns the CSL date of record's year and month, or of its biblatex
+    date: date-parts when it is a year or a YYYY-MM-DD date, the text as
+    written otherwise"""
+    date = record.get('issued') or record.get('date')
+    if isinstance(date, dict):
+        date = date.get('literal')
+    if not date:
+        return None
+    date = date.strip()
+    match = _date_re.match(date)
+    if match is None:
+        return {'literal': date}
+    parts = [int(part) for part in match.groups() if part is not None]
+    if len(parts) == 1:
+        month = record.get('month', '').strip().lower()
+        if month.isdigit() and 1 <= int(month) <= 12:
+            parts.append(int(month))
+        elif month[:3] in MONTHS:
+            parts.append(MONTHS.index(month[:3]) + 1)
+    return {'date-parts': [parts]}
+
+
+def names(text):
+    """Returns the CSL names of the bibtex names text"""
+    # like BibTeX, the name parser splits words at the ~ of an unbraced \~,
+    # so convert the accents which are not a braced special character
+    text = _unbraced_accent_re.sub(_accent, text)
+    return [dict((part, plain_text(value)) for part, value in author.items())
+            for author in bib.parse_authors(text)]
+
+
+def item(key, record):
+    """Returns record, a bib.Record whose key is key, as a CSL-JSON item made
+    of plain dicts and lists"""
+    type = record.entry_type
+    res = {'id': key, 'type': TYPES.get(type, 'document')}
+    for field in record:
+        if field in NAMES:
+            res[NAMES[field]] = names(record.text(field))
+        elif field == 'page':
+            res['page'] = plain_text(record.text(field).replace('--', '-'))
+        elif field == 'number':
+            res['issue' if type == 'article' else 'number'] = plain_text(record.text(field))
+        elif field in VARIABLES:
+            res.setdefault(VARIABLES[field], plain_text(record.text(field)))
+    date = issued(record)
+    if date is not None:
+        res['issued'] = date
+    return res
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode('utf-8')
+
+
+def serializer(backend=None):
+    """Returns the function serializing one item with backend, one of
+    BACKENDS, by default orjson if it is installed"""
+    if backend is None:
+        backend = 'json' if orjson is None else 'orjson'
+    if backend == 'orjson':
+        if orjson is None:
+            raise ValueError('orjson is not installed')
+        return _orjson_dumps
+    if backend == 'json':
+        return _json_dumps
+    raise ValueError('unknown backend "{}"'.format(backend))
+
+
+def iter_json(records, backend=None):
+    """Yields the text of a CSL-JSON array of the (key, record) pairs in
+    records, one item at a time"""
+    dumps = serializer(backend)
+    sep = '[\n'
+    for key, record in records:
+        yield sep + dumps(item(key, record))
+        sep = ',\n'
+    yield '[]\n' if sep == '[\n' else '\n]\n'
+
+
+def dump(records, fp, backend=None):
+    """Writes the CSL-JSON array of the (key, record) pairs in records to
+    fp, a text file object"""
+    for chunk in iter_json(records, backend):
+        fp.write(chunk)
+
+
+def dumps(records, backend=None):
+    """Returns the CSL-JSON array of the (key, record) pairs in records"""
+    return ''.join(iter_json(records, backend))
+
+
+def export(argv=None):
+    argparser = ArgumentParser(prog='bibcheck export', description="""
+    Export bibtex files as CSL-JSON
+    """)
+    argparser.add_argument('bibtex', nargs='+', help='.bib files, exported as one array')
+    argparser.add_argument('-o', '--output', help='Where to write the items. Default: standard output')
+    argparser.add_argument('--backend', choices=BACKENDS, help='How to serialize the items. Default: orjson if it is installed, json otherwise')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes parsing each file. Default=%(default)s')
+    args = argparser.parse_args(argv)
+    if args.backend == 'orjson' and orjson is None:
+        argparser.error('orjson is not installed')
+
+    def records():
+        for path in args.bibtex:
+            with open(path, 'r', encoding='utf-8') as f:
+                for record in bib.Bibparser('').iter_records(f, jobs=args.jobs):
+                    yield record
+
+    if args.output is None:
+        dump(records(), sys.stdout, args.backend)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            dump(records(), out, args.backend)
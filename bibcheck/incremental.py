@@ -0,0 +1,211 @@
+"""Incremental re-parsing of a bibliography which is edited between checks.
+
+A Document remembers the entries of the text it last parsed. When it is
+given the new text, it finds the range which differs from the old text,
+splits and parses again only the entries overlapping that range, and reuses
+the records of the others, with their line numbers moved if they moved.
+Validation results are kept alongside the records, so a Document can be
+passed to Bibparser.validate as its cache.
+"""
+from __future__ import absolute_import
+import bisect
+import hashlib
+
+from . import bib
+
+
+def common_prefix(a, b):
+    """Returns the length of the longest common prefix of a and b"""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a, b, limit):
+    """Returns the length of the longest common suffix of a and b, up to
+    limit characters"""
+    la, lb = len(a), len(b)
+    lo, hi = 0, min(la, lb, limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def shift(records, delta):
+    """Moves the line numbers of (key, record) pairs by delta"""
+    if delta == 0:
+        return
+    for key, record in records:
+        record.move(delta)
+
+
+class Entry(object):
+    """One entry of a Document, as split by bib.iter_entry_spans"""
+    __slots__ = ('start', 'line', 'text', 'macros', 'digest', 'records')
+
+    def __init__(self, start, line, text, macros, digest, records):
+        self.start = start
+        self.line = line
+        self.text = text
+        # the @string macros defined before the entry, and a digest of
+        # the @string entries defining them
+        self.macros = macros
+        self.digest = digest
+        self.records = records
+
+    def is_string(self):
+        return bib._string_re.match(self.text) is not None
+
+
+class Document(object):
+    """The parsed state of one bibliography. Results are only valid for the
+    schema and journal validator they were first checked with."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.data = None
+        self.entries = []
+        self.records = []
+        self.results = {}
+        # what the last update did: the (key, record) pairs it parsed
+        self.changed = []
+        self.n_entries = 0
+        self.n_parsed = 0
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, data):
+        """Parses data, the new text of the bibliography, reusing the
+        entries that did not change. Returns its (key, record) pairs in file
+        order."""
+        self.changed = []
+        self.n_parsed = 0
+        self.hits = 0
+        self.misses = 0
+        if self.data is None or not self._update_range(data):
+            self._update_all(data)
+        self.data = data
+        self.n_entries = len(self.entries)
+
+        records = []
+        for entry in self.entries:
+            records.extend(entry.records)
+        # results are keyed by id(record), so drop those of the records
+        # which are gone before those can be freed and their ids reused
+        live = set(id(record) for key, record in records)
+        self.results = dict((k, v) for k, v in self.results.items() if k in live)
+        self.records = records
+        return records
+
+    def _parse(self, parser, start, line, text, macros, digest):
+        if bib._string_re.match(text):
+            # the entry defines macros, leave the ones before it alone
+            parser.hashtable = dict(macros)
+        else:
+            parser.hashtable = macros
+        records = parser.parse_entry(line, text)
+        return Entry(start, line, text, macros, digest, records)
+
+    def _update_all(self, data):
+        """Splits all of data again, reusing the records of the entries
+        whose text and preceding @strings did not change"""
+        old = {}
+        for entry in self.entries:
+            if not entry.is_string():
+                old.setdefault((entry.digest, entry.text), entry)
+
+        parser = bib.Bibparser('', verbose=self.verbose)
+        macros = {}
+        digest = hashlib.sha1()
+        entries = []
+        for start, line, text in bib.iter_entry_spans([data]):
+            entry = old.pop((digest.hexdigest(), text), None)
+            if entry is None:
+                entry = self._parse(parser, start, line, text, macros, digest.hexdigest())
+                self.n_parsed += 1
+                self.changed.extend(entry.records)
+                if entry.is_string():
+                    macros = parser.hashtable
+                    digest.update(text.encode('utf-8'))
+            else:
+                shift(entry.records, line - entry.line)
+                entry.start = start
+                entry.line = line
+                entry.macros = macros
+            entries.append(entry)
+        self.entries = entries
+
+    def _update_range(self, data):
+        """Splits only the part of data which differs from self.data.
+        Returns False, leaving the Document as it was, when the edit touches
+        an @string, since that may change any entry after it."""
+        old = self.data
+        p = common_prefix(old, data)
+        if p == len(old) == len(data):
+            return True
+        q = common_suffix(old, data, min(len(old), len(data)) - p)
+        delta = len(data) - len(old)
+
+        # re-split from the last entry starting before the first change
+        starts = [entry.start for entry in self.entries]
+        i = bisect.bisect_left(starts, p) - 1
+        if i >= 0:
+            entry = self.entries[i]
+            start, line, macros, digest = entry.start, entry.line, entry.macros, entry.digest
+        else:
+            i = 0
+            start, line, macros, digest = 0, 1, {}, hashlib.sha1().hexdigest()
+
+        # old entries starting in the unchanged tail, by their new position
+        tail = dict((entry.start + delta, j) for j, entry in enumerate(self.entries)
+                    if entry.start >= len(old) - q)
+
+        parser = bib.Bibparser('', verbose=self.verbose)
+        new = []
+        j = len(self.entries)
+        for offset, ln, text in bib.iter_entry_spans([data[start:]], line):
+            if start + offset in tail:
+                # from here on the text splits as it did before
+                j = tail[start + offset]
+                moved = ln - self.entries[j].line
+                break
+            if bib._string_re.match(text):
+                return False
+            new.append(self._parse(parser, start + offset, ln, text, macros, digest))
+        if any(entry.is_string() for entry in self.entries[i:j]):
+            return False
+
+        for entry in self.entries[j:]:
+            shift(entry.records, moved)
+            entry.start += delta
+            entry.line += moved
+        for entry in new:
+            self.changed.extend(entry.records)
+        self.n_parsed += len(new)
+        self.entries = self.entries[:i] + new + self.entries[j:]
+        return True
+
+    # the cache interface of Bibparser.validate
+
+    def key(self, record):
+        return id(record)
+
+    def get(self, key):
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self.results[key] = result
@@ -1,39 +1,217 @@
 from __future__ import print_function, absolute_import
 import os
 import sys
+import multiprocessing
+import time
 from argparse import ArgumentParser
+from collections import Counter
 PY2 = sys.version_info[0] == 2
 if PY2:
     from codecs import open
 
+from . import abbrevs
 from . import bib
+from . import cache
+from . import csl
+from . import incremental
+from . import report
 from . import schemas
+from . import server
+
+# subcommands, given in place of the .bib files
+COMMANDS = {
+    'export': csl.export,
+    'serve': server.serve,
+    'client': server.client,
+}
 
 
 def parse_cmd_line():
     def bibtexfilename(fn):
-        if not fn.endswith('.bib'):
+        if not fn.endswith('.bib') and not os.path.isdir(fn):
             raise ValueError('bibtex filename must end in .bib')
         return fn
 
     argparser = ArgumentParser(description="""
     Validator for bibtex files
     """)
-    argparser.add_argument('bibtex', type=bibtexfilename)
+    argparser.add_argument('bibtex', type=bibtexfilename, nargs='+', help='.bib files, or directories to search for them')
     argparser.add_argument('-v', '--verbose', action='store_true')
-    argparser.add_argument('--schema', default='ACS', help='The schema specifies which bibtex fields are required for a particular journal. Default="ACS"', choices=['ACS'])
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes to use. With several files each process validates whole files, with one file they share the parsing. Default=1')
+    argparser.add_argument('--stats', action='store_true', help='Report how many journal lookups were answered from the cache')
+    argparser.add_argument('--schema', default='ACS', type=schemas.argument, help='The schema specifies which bibtex fields are required for a particular journal: ACS, or a .json or .yaml file. Several comma separated schemas are checked in one pass. Default="ACS"')
+    argparser.add_argument('--cache-dir', default=cache.default_cache_dir(), help='Where to keep the results of previous runs, so that unchanged entries are not checked again. Default="%(default)s"')
+    argparser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None, help='Check every entry, without reading or writing the cache')
+    argparser.add_argument('--clear-cache', action='store_true', help='Empty the cache before running')
+    argparser.add_argument('--format', choices=report.FORMATS, default='text', help='How to write the report: text, coloured on a terminal, JSON Lines, or a SARIF log. Default=%(default)s')
+    argparser.add_argument('--max-errors', type=int, metavar='N', help='Stop after reporting N errors')
+    argparser.add_argument('--watch', action='store_true', help='Keep running, and validate the file again whenever it changes, reporting only the entries which were edited')
+    argparser.add_argument('--interval', type=float, default=0.5, help='How often --watch looks for changes, in seconds. Default=%(default)s')
 
     args = argparser.parse_args()
     # print args
     return args
 
+def find_bibtex(paths):
+    """Expands the directories in paths to the .bib files below them"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fn in sorted(files):
+                    if fn.endswith('.bib'):
+                        yield os.path.join(root, fn)
+        else:
+            yield path
+
+def check_file(path, args, journal_validator, jobs=1, out=None, reporter=None):
+    """Validates one .bib file, reporting to reporter, or printing the
+    report to out"""
+    results = None
+    if args.cache_dir is not None:
+        results = cache.ResultCache(cache.cache_path(args.cache_dir, path), args.schema, journal_validator.version)
+
+    bibobject = bib.Bibparser('', verbose=args.verbose)
+    with open(path, 'r', encoding='utf-8') as f:
+        summary = bibobject.validate(args.schema, journal_validator, stats=args.stats,
+                                     records=bibobject.iter_records(f, jobs=jobs), out=out,
+                                     cache=results, reporter=reporter)
+    if results is not None:
+        results.save()
+    return summary
+
+def watch(path, args, sleep=time.sleep):
+    """Validates path, then again each time its modification time or size
+    changes and then stays the same for an interval. Only the entries
+    re-parsed after an edit are reported. Runs until interrupted; sleep is
+    called with the interval between looks at the file."""
+    journal_validator = abbrevs.Validator()
+    document = incremental.Document(args.verbose)
+    reporter = report.reporter(args.format, max_errors=args.max_errors, path=path)
+    stamp = None
+    pending = None
+    while True:
+        try:
+            st = os.stat(path)
+            new_stamp = (st.st_mtime, st.st_size)
+        except OSError:
+            # the editor may be replacing the file
+            new_stamp = stamp
+        if new_stamp != stamp and new_stamp != pending:
+            # still being written, look again once it has stayed the same
+            # for an interval
+            pending = new_stamp
+        elif new_stamp != stamp:
+            stamp = new_stamp
+            with open(path, 'r', encoding='utf-8') as f:
+                data = f.read()
+            first = document.data is None
+            # each run is reported as a whole
+            reporter.start_file(path)
+            reporter.errors = reporter.warnings = 0
+            try:
+                document.update(data)
+            except Exception as e:
+                # most likely saved halfway through an edit, wait for the next save
+                reporter.report(report.Diagnostic('unreadable-file', value='could not parse {}: {}'.format(path, e)))
+            else:
+                if first:
+                    records = document.records
+                else:
+                    reporter.note('{} changed: {} of {} entries parsed'.format(path, document.n_parsed, document.n_entries))
+                    records = document.changed
+                bib.Bibparser('').validate(args.schema, journal_validator, stats=args.stats,
+                                           records=records, cache=document, reporter=reporter)
+            reporter.flush()
+            sys.stdout.flush()
+        sleep(args.interval)
+
+# the abbreviation index of a worker process, shared by all its files
+_journal_validator = None
+
+def _init_worker():
+    global _journal_validator
+    _journal_validator = abbrevs.Validator()
+
+def _check_file(job):
+    """Validates one of several files, returning what it reports as a
+    report.Collector so that reports from different processes are not
+    interleaved"""
+    path, args = job
+    collector = report.Collector(args.max_errors)
+    try:
+        summary = check_file(path, args, _journal_validator, reporter=collector)
+    except Exception as e:
+        collector.report(report.Diagnostic('unreadable-file', value='could not validate {}: {}'.format(path, e)))
+        collector.flush()
+        summary = {'failed': 1}
+    return collector, summary
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     args = parse_cmd_line()
-    with open(args.bibtex, 'r', encoding='utf-8') as f:
-        lines = os.linesep.join(l.strip() for l in f)
+    if args.clear_cache and args.cache_dir is not None:
+        cache.clear(args.cache_dir)
+    paths = list(find_bibtex(args.bibtex))
+    if args.watch:
+        if len(paths) != 1:
+            sys.exit('--watch takes a single .bib file')
+        if args.format == 'sarif':
+            sys.exit('--watch writes text or JSON Lines, not SARIF')
+        try:
+            watch(paths[0], args)
+        except KeyboardInterrupt:
+            pass
+        return
+    reporter = report.reporter(args.format, max_errors=args.max_errors)
+    if len(paths) == 1:
+        reporter.start_file(paths[0])
+        summary = check_file(paths[0], args, abbrevs.Validator(), jobs=args.jobs, reporter=reporter)
+        reporter.close()
+        return 1 if summary['errors'] else 0
+
+    jobs = [(path, args) for path in paths]
+    pool = None
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs, initializer=_init_worker)
+        reports = pool.imap(_check_file, jobs)
+    else:
+        _init_worker()
+        reports = map(_check_file, jobs)
 
-    bibobject = bib.Bibparser(lines, verbose=args.verbose)
-    bibobject.parse()
+    total = Counter()
+    n_files = 0
+    for path, (collector, summary) in zip(paths, reports):
+        reporter.start_file(path)
+        if args.format == 'text':
+            reporter.note('{}:'.format(path))
+        collector.replay(reporter)
+        if args.format == 'text':
+            reporter.note('')
+        total.update(summary)
+        n_files += 1
+        if reporter.full:
+            break
+    if pool is not None:
+        if n_files < len(paths):
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
 
-    schema = getattr(schemas, args.schema)
-    bibobject.validate(schema)
+    reporter.start_file(None)
+    if args.format == 'text':
+        reporter.note('Files validated: {}, entries validated: {}, errors: {}, warnings: {}'.format(
+            n_files - total['failed'], total['entries'], total['errors'], total['warnings']))
+        if total['failed']:
+            reporter.note('Files that could not be validated: {}'.format(total['failed']))
+        if n_files < len(paths):
+            reporter.note('Stopped after {} errors, files not validated: {}'.format(
+                reporter.errors, len(paths) - n_files))
+    else:
+        reporter.summary(dict(total, files=n_files))
+    reporter.close()
+    # the exit status: whether any file had errors or could not be validated
+    return 1 if total['errors'] or total['failed'] else 0
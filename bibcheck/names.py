@@ -0,0 +1,237 @@
+"""BibTeX names: splitting author lists, and the First von Last, jr parts.
+
+    >>> parse_name('Ludwig van Beethoven')
+    Name(first='Ludwig', von='van', last='Beethoven', jr='')
+    >>> parse_name('Ford, Jr., Henry')
+    Name(first='Henry', von='', last='Ford', jr='Jr.')
+    >>> format_name('Donald Ervin Knuth', '{f.~}{vv~}{ll}{, jj}')
+    'D.~E. Knuth'
+
+The rules are those of BibTeX's name parsing, as described in "Tame the
+BeaST": "and" and commas only separate names and parts outside braces,
+and the von part is made of the words starting with a lower case letter.
+The same authors appear in many entries, so results are cached per raw
+string.
+"""
+from __future__ import absolute_import
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+CACHE_SIZE = 1 << 16
+
+Name = namedtuple('Name', 'first von last jr')
+
+_and_re = re.compile(r'[{}]|\s+and\s+', re.IGNORECASE)
+_comma_re = re.compile(r'[{}]|,')
+_word_re = re.compile(r'[{}]|[\s~-]+')
+# the control sequences standing for letters, whose case is their own
+_foreign_re = re.compile(r'\{\s*\\(oe|OE|ae|AE|aa|AA|o|O|l|L|ss|i|j)(?![A-Za-z])')
+_command_re = re.compile(r'\{\s*\\([A-Za-z]+|.)')
+
+
+def _split(s, sep_re):
+    """Splits s at the matches of sep_re which are outside braces. Returns
+    the pieces, and the separators before each piece ('' for the first)."""
+    if '{' not in s and '}' not in s:
+        pieces = sep_re.split(s)
+        return pieces, [''] + sep_re.findall(s)
+    pieces = []
+    seps = ['']
+    depth = 0
+    start = 0
+    for item in sep_re.finditer(s):
+        sep = item.group()
+        if sep == '{':
+            depth += 1
+        elif sep == '}':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            pieces.append(s[start:item.start()])
+            seps.append(sep)
+            start = item.end()
+    pieces.append(s[start:])
+    return pieces, seps
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_names(names):
+    """Returns the names of an author list, split at "and" outside braces"""
+    names = names.strip()
+    if not names:
+        return ()
+    return tuple(name.strip() for name in _split(names, _and_re)[0])
+
+
+def words(part):
+    """Returns the (word, separator before it) pairs of a name part. The
+    separator is '-' for hyphenated words, ' ' otherwise."""
+    pieces, seps = _split(part, _word_re)
+    res = []
+    for word, sep in zip(pieces, seps):
+        if word:
+            res.append((word, '-' if '-' in sep else ' '))
+    return res
+
+
+def is_lower(word):
+    """Tells whether word starts with a lower case letter, and so belongs to
+    the von part. Braced groups are caseless, except for special characters,
+    groups starting with a control sequence, such as {\\'e}."""
+    depth = 0
+    for i, c in enumerate(word):
+        if c == '{':
+            if depth == 0:
+                item = _foreign_re.match(word, i)
+                if item is not None:
+                    return item.group(1).islower()
+                item = _command_re.match(word, i)
+                if item is not None:
+                    # the case of the first letter after the control sequence
+                    for c in word[item.end():]:
+                        if c == '}':
+                            break
+                        if c.isalpha():
+                            return c.islower()
+                    return False
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif depth == 0 and c.isalpha():
+            return c.islower()
+    return False
+
+
+def _join(pairs):
+    return ''.join((sep if i else '') + word for i, (word, sep) in enumerate(pairs))
+
+
+def _von_last(pairs):
+    """Splits the words before the first comma into von and last, von running
+    up to the last lower case word before the last word"""
+    von_end = 0
+    for i in range(len(pairs) - 1):
+        if is_lower(pairs[i][0]):
+            von_end = i + 1
+    return pairs[:von_end], pairs[von_end:]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_name(name):
+    """Returns the Name of one author, as written in a .bib file"""
+    parts = [part.strip() for part in _split(name.strip(), _comma_re)[0]]
+    if len(parts) == 1:
+        # First von Last
+        pairs = words(parts[0])
+        von_start = None
+        for i in range(len(pairs) - 1):
+            if is_lower(pairs[i][0]):
+                von_start = i
+                break
+        if von_start is None:
+            first, von, last = pairs[:-1], [], pairs[-1:]
+        else:
+            von, last = _von_last(pairs[von_start:])
+            first = pairs[:von_start]
+        jr = []
+    else:
+        # von Last, First or von Last, Jr, First
+        von, last = _von_last(words(parts[0]))
+        if len(parts) == 2:
+            jr, first = [], words(parts[1])
+        else:
+            jr, first = words(parts[1]), words(parts[2])
+    return Name(_join(first), _join(von), _join(last), _join(jr))
+
+
+def _abbreviate(word):
+    """Returns the first letter of word, or its first braced group"""
+    if word[0] != '{':
+        return word[0]
+    depth = 0
+    for i, c in enumerate(word):
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return word[:i + 1]
+    return word
+
+
+def _format_part(pairs, abbreviate, pre, sep, post):
+    if not pairs:
+        return ''
+    out = []
+    for i, (word, word_sep) in enumerate(pairs):
+        if i:
+            if sep is not None:
+                out.append(sep)
+            else:
+                if abbreviate:
+                    out.append('.')
+                if word_sep == '-':
+                    out.append('-')
+                elif i == len(pairs) - 1 or len(''.join(out)) < 3:
+                    # tie the last word, and the words after a short
+                    # start, to the previous one
+                    out.append('~')
+                else:
+                    out.append(' ')
+        out.append(_abbreviate(word) if abbreviate else word)
+    text = ''.join(out)
+    if post.endswith('~~'):
+        post = post[:-1]
+    elif post.endswith('~') and len(text) >= 3:
+        # a discretionary tie, which long parts do not need
+        post = post[:-1] + ' '
+    return pre + text + post
+
+
+def _group_end(fmt, i):
+    """Returns the offset past the brace group of fmt starting at i"""
+    depth = 0
+    for j in range(i, len(fmt)):
+        if fmt[j] == '{':
+            depth += 1
+        elif fmt[j] == '}':
+            depth -= 1
+            if depth == 0:
+                return j + 1
+    return len(fmt)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_name(name, fmt):
+    """Formats one author as the format.name$ builtin of BibTeX styles does:
+    in fmt, {ff}, {vv}, {ll} and {jj} stand for the parts of the name, {f},
+    {v}, {l} and {j} for their abbreviations. Text inside the braces is only
+    output when the part is not empty."""
+    parts = dict(zip('fvlj', (words(part) for part in parse_name(name))))
+    out = []
+    i = 0
+    while i < len(fmt):
+        if fmt[i] != '{':
+            out.append(fmt[i])
+            i += 1
+            continue
+        end = _group_end(fmt, i)
+        group = fmt[i + 1:end - 1]
+        item = re.search(r'[a-zA-Z]', group)
+        if item is None or item.group().lower() not in parts:
+            out.append(group)
+        else:
+            letter = item.group().lower()
+            pre = group[:item.start()]
+            j = item.end()
+            abbreviate = not group[j:j + 1].lower() == letter
+            if not abbreviate:
+                j += 1
+            sep = None
+            if group[j:j + 1] == '{':
+                k = _group_end(group, j)
+                sep = group[j + 1:k - 1]
+                j = k
+            out.append(_format_part(parts[letter], abbreviate, pre, sep, group[j:]))
+        i = end
+    return ''.join(out)
@@ -0,0 +1,268 @@
+"""Reporting what validation finds.
+
+Bibparser.validate turns every finding into a Diagnostic and hands it to a
+Reporter, which writes the diagnostics to its output in batches, as text
+(coloured on a terminal), as JSON Lines, one object per diagnostic, or as
+a SARIF log for code scanning tools.
+"""
+from __future__ import absolute_import
+import json
+import sys
+from collections import namedtuple
+
+from . import __version__
+
+# diagnostic code -> level, and the SARIF description of the rule
+CODES = {
+    'missing-field': ('error', 'A field required by the schema is missing'),
+    'journal-abbreviation': ('warning', 'The journal is not a known abbreviation'),
+    'unknown-type': ('note', 'The schema has no entry for the entry type'),
+    'unreadable-file': ('error', 'The file could not be read or parsed'),
+}
+
+FORMATS = ('text', 'jsonl', 'sarif')
+
+BATCH_SIZE = 256
+
+
+class Diagnostic(namedtuple('Diagnostic', 'code key line field value suggestion schemas')):
+    """One finding: its code (a key of CODES), the entry key and line, the
+    field concerned and its value, a suggested replacement, and the names of
+    the schemas it was found against, when several schemas were checked"""
+    __slots__ = ()
+
+    def __new__(cls, code, key=None, line=None, field=None, value=None, suggestion=None, schemas=None):
+        return super(Diagnostic, cls).__new__(cls, code, key, line, field, value, suggestion, schemas)
+
+    @property
+    def level(self):
+        return CODES[self.code][0]
+
+    def message(self):
+        if self.code == 'missing-field':
+            msg = '"{}" is missing field "{}" on line {}'.format(self.key, self.field, self.line)
+            if self.schemas:
+                msg += ' ({})'.format(', '.join(self.schemas))
+            return msg
+        if self.code == 'journal-abbreviation':
+            return 'Journal in {} (line {}), "{}" was not correct. Consider "{}"'.format(
+                self.key, self.line, self.value, self.suggestion)
+        if self.code == 'unknown-type':
+            return 'Schema does not have an entry for type={}'.format(self.value)
+        return self.value or self.code
+
+    def as_dict(self):
+        """Returns the fields which are set, and the level"""
+        res = dict((k, v) for k, v in zip(self._fields, self) if v is not None)
+        res['level'] = self.level
+        return res
+
+
+class Reporter(object):
+    """Collects diagnostics, and writes them to out (sys.stdout by default)
+    every BATCH_SIZE diagnostics and on flush.
+
+    Counts the errors and warnings reported; once max_errors errors were
+    reported, full is True and validation stops. Subclasses implement
+    write, and may implement note and summary.
+    """
+
+    def __init__(self, out=None, max_errors=None, path=None):
+        self.out = sys.stdout if out is None else out
+        self.max_errors = max_errors
+        self.path = path
+        self.batch = []
+        self.errors = 0
+        self.warnings = 0
+        # unknown types are only reported once per file
+        self.types = set()
+
+    def start_file(self, path):
+        """Reports the following diagnostics as found in path"""
+        self.flush()
+        self.path = path
+        self.types = set()
+
+    def report(self, diagnostic):
+        if diagnostic.code == 'unknown-type':
+            if diagnostic.value in self.types:
+                return
+            self.types.add(diagnostic.value)
+        level = diagnostic.level
+        if level == 'error':
+            self.errors += 1
+        elif level == 'warning':
+            self.warnings += 1
+        self.batch.append(diagnostic)
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    @property
+    def full(self):
+        return self.max_errors is not None and self.errors >= self.max_errors
+
+    def flush(self):
+        if self.batch:
+            self.write(self.batch)
+            self.batch = []
+
+    def write(self, diagnostics):
+        raise NotImplementedError
+
+    def note(self, text):
+        """Writes a line of the human readable summary"""
+        self.flush()
+
+    def summary(self, counts):
+        """Records the counts returned by Bibparser.validate"""
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+
+class TextReporter(Reporter):
+    """Writes diagnostics as lines of text, coloured if color is true, which
+    by default it is when out is a terminal"""
+
+    def __init__(self, out=None, max_errors=None, path=None, color=None):
+        Reporter.__init__(self, out, max_errors, path)
+        if color is None:
+            isatty = getattr(self.out, 'isatty', None)
+            color = isatty is not None and isatty()
+        self.color = color
+
+    def format(self, diagnostic):
+        if diagnostic.code == 'unknown-type':
+            return 'Warning: {}\n'.format(diagnostic.message())
+        if diagnostic.level == 'error':
+            line = 'ERROR: {}'.format(diagnostic.message())
+            colour = '\033[91m'
+        else:
+            line = 'WARNING: {}'.format(diagnostic.message())
+            colour = '\033[93m'
+        if self.color:
+            line = colour + line + '\033[0m'
+        if diagnostic.code == 'journal-abbreviation':
+            line += '\n'
+        return line + '\n'
+
+    def write(self, diagnostics):
+        self.out.write(''.join([self.format(d) for d in diagnostics]))
+
+    def note(self, text):
+        self.flush()
+        self.out.write(text + '\n')
+
+
+class JsonLinesReporter(Reporter):
+    """Writes one JSON object per diagnostic, with the file it is in, and
+    one with the summary counts of each file"""
+
+    def dumps(self, obj):
+        if self.path is not None:
+            obj['file'] = self.path
+        return json.dumps(obj, sort_keys=True) + '\n'
+
+    def write(self, diagnostics):
+        self.out.write(''.join([self.dumps(d.as_dict()) for d in diagnostics]))
+
+    def summary(self, counts):
+        self.flush()
+        self.out.write(self.dumps({'summary': counts}))
+
+
+class SarifReporter(Reporter):
+    """Writes a SARIF 2.1.0 log with one run, streaming its results"""
+
+    def __init__(self, out=None, max_errors=None, path=None):
+        Reporter.__init__(self, out, max_errors, path)
+        self.started = False
+
+    def start(self):
+        rules = [{'id': code, 'shortDescription': {'text': description},
+                  'defaultConfiguration': {'level': level}}
+                 for code, (level, description) in sorted(CODES.items())]
+        log = json.dumps({
+            '$schema': 'https://json.schemastore.org/sarif-2.1.0.json',
+            'version': '2.1.0',
+        }, sort_keys=True)
+        tool = json.dumps({'driver': {'name': 'bibcheck', 'version': __version__, 'rules': rules}},
+                          sort_keys=True)
+        # the log, up to its one run's results, which close ends
+        self.out.write(log[:-1] + ', "runs": [{"tool": ' + tool + ', "results": [')
+        self.started = True
+
+    def result(self, diagnostic):
+        properties = diagnostic.as_dict()
+        for k in ('code', 'line', 'level'):
+            properties.pop(k, None)
+        res = {
+            'ruleId': diagnostic.code,
+            'level': diagnostic.level,
+            'message': {'text': diagnostic.message()},
+            'properties': properties,
+        }
+        location = {}
+        if self.path is not None:
+            location['artifactLocation'] = {'uri': self.path}
+        if diagnostic.line is not None:
+            location['region'] = {'startLine': diagnostic.line}
+        if location:
+            res['locations'] = [{'physicalLocation': location}]
+        return json.dumps(res, sort_keys=True)
+
+    def write(self, diagnostics):
+        results = ','.join([self.result(d) for d in diagnostics])
+        if not self.started:
+            self.start()
+        else:
+            results = ',' + results
+        self.out.write(results)
+
+    def close(self):
+        self.flush()
+        if not self.started:
+            self.start()
+        self.out.write(']}]}\n')
+
+
+class Collector(Reporter):
+    """Keeps the diagnostics, notes and summary instead of writing them, so
+    that they can be sent from a worker process and replayed into another
+    reporter"""
+
+    def __init__(self, max_errors=None):
+        Reporter.__init__(self, out=False, max_errors=max_errors)
+        self.items = []
+
+    def write(self, diagnostics):
+        self.items.extend(diagnostics)
+
+    def note(self, text):
+        self.flush()
+        self.items.append(('note', text))
+
+    def summary(self, counts):
+        self.flush()
+        self.items.append(('summary', counts))
+
+    def replay(self, reporter):
+        for item in self.items:
+            if isinstance(item, Diagnostic):
+                reporter.report(item)
+            elif item[0] == 'note':
+                reporter.note(item[1])
+            else:
+                reporter.summary(item[1])
+
+
+def reporter(format='text', out=None, max_errors=None, path=None, color=None):
+    """Returns a reporter for one of FORMATS"""
+    if format == 'text':
+        return TextReporter(out, max_errors, path, color)
+    if format == 'jsonl':
+        return JsonLinesReporter(out, max_errors, path)
+    if format == 'sarif':
+        return SarifReporter(out, max_errors, path)
+    raise ValueError('unknown format "{}"'.format(format))
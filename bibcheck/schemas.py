@@ -1,3 +1,27 @@
+"""Schemas, which specify the fields each type of entry requires.
+
+A schema maps entry types to their fields, in one of the forms
+
+    {"article": {"author": [], "title": [], ...}}    all fields required
+    {"article": ["author", "title", ...]}           all fields required
+    {"article": {"required": ["author", "title"], "optional": ["doi"]}}
+
+Besides the built-in schemas below, load() reads schemas in these forms
+from .json files, and from .yaml or .yml files when PyYAML is installed.
+A SchemaSet checks records against several schemas at once.
+
+Schemas are compiled to bit masks: every field name is interned to a bit,
+bib.Record keeps the mask of the fields it has, and the fields a record
+is missing are found with one bitwise operation. Fields are named as in
+.bib files or as in records: year and pages, which records hold as issued
+and page, are the same fields as those, but reported as written.
+"""
+from __future__ import absolute_import
+import json
+import os
+from argparse import ArgumentTypeError
+from collections import OrderedDict
+
 ACS = {
     'article': {
         'author': [],
@@ -19,3 +43,193 @@ ACS = {
         'issued': []
     }
 }
+
+BUILTIN = ('ACS',)
+
+# bibtex fields which records hold under their CSL-JSON names
+RENAMED = {'year': 'issued', 'pages': 'page'}
+
+# field name -> bit, with the spellings seen in .bib files as aliases of the
+# lower case name. Bits are only meaningful within one process.
+_field_bits = {}
+_field_names = []
+
+
+def field_bit(name):
+    """Returns the bit standing for the field name, interning it on first use"""
+    bit = _field_bits.get(name)
+    if bit is None:
+        lower = name.lower()
+        bit = _field_bits.get(lower)
+        if bit is None:
+            bit = 1 << len(_field_names)
+            _field_names.append(lower)
+            _field_bits[lower] = bit
+        _field_bits[name] = bit
+    return bit
+
+
+def field_mask(names):
+    """Returns the mask of the field names"""
+    mask = 0
+    for name in names:
+        mask |= field_bit(name)
+    return mask
+
+
+def _record_bit(name):
+    """Returns the bit of the field name as records hold it"""
+    name = name.lower()
+    return field_bit(RENAMED.get(name, name))
+
+
+def _record_mask(names):
+    mask = 0
+    for name in names:
+        mask |= _record_bit(name)
+    return mask
+
+
+def entry_type(record):
+    """Returns the lower case entry type of record, a bib.Record or, for
+    other mappings, their 'type'"""
+    type = getattr(record, 'entry_type', None)
+    if type is None:
+        type = record['type']
+    return type.lower()
+
+
+class Schema(object):
+    """A schema compiled to the masks of the required and optional fields of
+    each entry type"""
+
+    def __init__(self, definition, name=None):
+        if not isinstance(definition, dict):
+            raise ValueError('a schema must map entry types to their fields')
+        self.definition = definition
+        self.name = name
+        self.required = {}
+        self.optional = {}
+        # the (name, bit) pairs of the required fields of each type, in the
+        # order of the definition, so that reports are reproducible
+        self.fields = {}
+        for type, fields in definition.items():
+            if isinstance(fields, dict) and fields and set(fields) <= set(['required', 'optional']):
+                required, optional = fields.get('required', []), fields.get('optional', [])
+            elif isinstance(fields, (dict, list)):
+                required, optional = list(fields), []
+            else:
+                raise ValueError('fields of type "{}" must be a list or a mapping'.format(type))
+            type = type.lower()
+            self.fields[type] = []
+            for f in required:
+                bit = _record_bit(f)
+                # year and issued are one field
+                if not any(bit == b for name, b in self.fields[type]):
+                    self.fields[type].append((f.lower(), bit))
+            self.required[type] = _record_mask(required)
+            self.optional[type] = _record_mask(optional)
+
+    def __reduce__(self):
+        # bits differ between processes, so compile again after unpickling
+        return Schema, (self.definition, self.name)
+
+    def missing(self, record):
+        """Returns the required fields record lacks, or None if the schema
+        has no entry for the record's type"""
+        type = entry_type(record)
+        required = self.required.get(type)
+        if required is None:
+            return None
+        mask = getattr(record, 'mask', None)
+        if mask is None:
+            mask = field_mask(record)
+        lacking = required & ~mask
+        if not lacking:
+            return []
+        return [name for name, bit in self.fields[type] if lacking & bit]
+
+
+class SchemaSet(object):
+    """Several compiled schemas, checked together so that a record is only
+    looked at once however many schemas there are"""
+
+    def __init__(self, schemas):
+        self.schemas = list(schemas)
+        self.names = [schema.name or 'schema {}'.format(i + 1)
+                      for i, schema in enumerate(self.schemas)]
+        self.definition = [[name, schema.definition] for name, schema in zip(self.names, self.schemas)]
+        # the union of the required masks of each type, and the
+        # (name, bit, schema names) of its required fields
+        self.required = {}
+        self.fields = {}
+        for schema in self.schemas:
+            for type in schema.required:
+                self.required[type] = self.required.get(type, 0) | schema.required[type]
+        for type in self.required:
+            fields = OrderedDict()
+            for name, schema in zip(self.names, self.schemas):
+                for field, bit in schema.fields.get(type, ()):
+                    # named as in the first schema requiring it
+                    fields.setdefault(bit, (field, []))[1].append(name)
+            self.fields[type] = [(field, bit, names) for bit, (field, names) in fields.items()]
+
+    def __reduce__(self):
+        # like Schema, compile again from the schemas after unpickling
+        return SchemaSet, (self.schemas,)
+
+    def missing(self, record):
+        """Returns the (field, names of the schemas requiring it) pairs of the
+        required fields record lacks, or None if no schema has an entry for
+        the record's type"""
+        type = entry_type(record)
+        required = self.required.get(type)
+        if required is None:
+            return None
+        mask = getattr(record, 'mask', None)
+        if mask is None:
+            mask = field_mask(record)
+        lacking = required & ~mask
+        if not lacking:
+            return []
+        return [(field, names) for field, bit, names in self.fields[type] if lacking & bit]
+
+
+def compile(schema):
+    """Returns schema as a SchemaSet: schema may already be one, a Schema, a
+    definition, or a list of those"""
+    if isinstance(schema, SchemaSet):
+        return schema
+    if not isinstance(schema, list):
+        schema = [schema]
+    return SchemaSet(s if isinstance(s, Schema) else Schema(s) for s in schema)
+
+
+def load(name):
+    """Returns the compiled schema name, either a built-in schema or the path
+    of a .json, .yaml or .yml file"""
+    if name in BUILTIN:
+        return Schema(globals()[name], name)
+    ext = os.path.splitext(name)[1].lower()
+    if ext == '.json':
+        with open(name) as f:
+            definition = json.load(f)
+    elif ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('PyYAML is required to read {}'.format(name))
+        with open(name) as f:
+            definition = yaml.safe_load(f)
+    else:
+        raise ValueError('unknown schema "{}": expected one of {} or a .json, .yaml or .yml file'.format(
+            name, ', '.join(BUILTIN)))
+    return Schema(definition, os.path.splitext(os.path.basename(name))[0])
+
+
+def argument(names):
+    """Loads the comma separated schema names of a --schema option"""
+    try:
+        return SchemaSet(load(name) for name in names.split(','))
+    except (IOError, OSError, ValueError) as e:
+        raise ArgumentTypeError(str(e))
@@ -0,0 +1,205 @@
+"""A bibcheck daemon for editors which check the bibliography on every save.
+
+    bibcheck serve [--socket PATH]
+    bibcheck client [--socket PATH] [--stdin] file.bib
+
+The server keeps the abbreviation index loaded and an incremental.Document
+per file, so a check only re-parses and re-validates the entries which
+changed since the previous one. The client sends a path (and with --stdin
+the unsaved buffer) over a Unix socket and prints the report it gets back.
+
+The protocol is one JSON object per line each way. Requests have a "path",
+an optional "buffer" holding the text to check instead of the file, and an
+optional "stats" flag and "color" flag, true when the report is to be
+coloured for a terminal; responses have the "report" text and the "summary"
+counts, or an "error".
+"""
+from __future__ import print_function, absolute_import
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import tempfile
+from argparse import ArgumentParser
+from io import StringIO
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import abbrevs
+from . import bib
+from . import incremental
+from . import report
+from . import schemas
+
+# journal titles whose recommendation the server remembers
+CACHE_SIZE = 1 << 14
+
+
+def default_socket_path():
+    """Returns $XDG_RUNTIME_DIR/bibcheck.sock, or a per-user socket in /tmp"""
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'bibcheck.sock')
+    return os.path.join(tempfile.gettempdir(), 'bibcheck-%d.sock' % os.getuid())
+
+
+def check_owner(st, path):
+    """Raises ValueError unless st, the os.stat of path, is of a file of the
+    current user. The default socket path in /tmp can be taken by anyone,
+    and requests carry unsaved editor buffers."""
+    if st.st_uid != os.getuid():
+        raise ValueError('{} belongs to another user'.format(path))
+
+
+def remove_stale_socket(path):
+    """Removes the socket at path if it was left behind by a server which did
+    not shut down cleanly. Raises ValueError if path is not a socket of the
+    current user, or if a server still answers on it."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise ValueError('{} exists and is not a socket'.format(path))
+    check_owner(st, path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        os.remove(path)
+        return
+    finally:
+        sock.close()
+    raise ValueError('a server is already running on {}'.format(path))
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                report, summary = self.server.check(
+                    request['path'], request.get('buffer'), request.get('stats', False),
+                    request.get('color', False))
+                response = {'report': report, 'summary': summary}
+            except Exception as e:
+                response = {'error': '{}: {}'.format(type(e).__name__, e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class Server(socketserver.UnixStreamServer):
+    def __init__(self, path, schema, verbose=False):
+        remove_stale_socket(path)
+        self.schema = schema
+        self.verbose = verbose
+        # the server runs for days, so only remember recent journals
+        self.journal_validator = abbrevs.Validator(cache_size=CACHE_SIZE)
+        self.documents = {}
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+
+    def server_bind(self):
+        # only the current user may connect; the umask applies as the socket
+        # is created, so there is no window before a chmod
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def check(self, path, buffer=None, stats=False, color=False):
+        """Validates path, or buffer as the contents of path if given.
+        Returns the report, coloured if color is true, and the summary
+        counts of Bibparser.validate"""
+        if buffer is None:
+            with open(path, 'rb') as f:
+                buffer = f.read().decode('utf-8')
+        path = os.path.abspath(path)
+        if path not in self.documents:
+            self.documents[path] = incremental.Document(self.verbose)
+        document = self.documents[path]
+        records = document.update(buffer)
+
+        out = StringIO()
+        reporter = report.TextReporter(out, color=color)
+        summary = bib.Bibparser('').validate(self.schema, self.journal_validator, stats=stats,
+                                             records=records, cache=document, reporter=reporter)
+        if stats:
+            reporter.note('Entries parsed: {} of {}'.format(document.n_parsed, document.n_entries))
+        reporter.close()
+        return out.getvalue(), summary
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def serve(argv=None):
+    argparser = ArgumentParser(prog='bibcheck serve', description="""
+    Serve bibtex validation on a Unix socket
+    """)
+    argparser.add_argument('--socket', default=default_socket_path(), help='Default="%(default)s"')
+    argparser.add_argument('-v', '--verbose', action='store_true')
+    argparser.add_argument('--schema', default='ACS', type=schemas.argument, help='The schema specifies which bibtex fields are required for a particular journal: ACS, or a .json or .yaml file. Several comma separated schemas are checked in one pass. Default="ACS"')
+    args = argparser.parse_args(argv)
+
+    try:
+        server = Server(args.socket, args.schema, verbose=args.verbose)
+    except ValueError as e:
+        argparser.error(str(e))
+    # so that the socket is removed on kill too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request(socket_path, path, buffer=None, stats=False, color=False):
+    """Asks the server at socket_path to check path; returns its response.
+    Raises ValueError if the socket belongs to another user."""
+    message = {'path': os.path.abspath(path), 'stats': stats, 'color': color}
+    if buffer is not None:
+        message['buffer'] = buffer
+    try:
+        st = os.stat(socket_path)
+    except OSError:
+        # connect reports that no server is running
+        pass
+    else:
+        check_owner(st, socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline().decode('utf-8'))
+    finally:
+        sock.close()
+
+
+def client(argv=None):
+    argparser = ArgumentParser(prog='bibcheck client', description="""
+    Validate a bibtex file with a running bibcheck server
+    """)
+    argparser.add_argument('bibtex')
+    argparser.add_argument('--socket', default=default_socket_path(), help='Default="%(default)s"')
+    argparser.add_argument('--stdin', action='store_true', help='Check the text on stdin as the contents of the file')
+    argparser.add_argument('--stats', action='store_true')
+    args = argparser.parse_args(argv)
+
+    buffer = sys.stdin.read() if args.stdin else None
+    try:
+        response = request(args.socket, args.bibtex, buffer, args.stats, sys.stdout.isatty())
+    except ValueError as e:
+        response = {'error': str(e)}
+    if 'error' in response:
+        print(response['error'], file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(response['report'])
@@ -1,10 +1,13 @@
+import re
 from setuptools import setup
-__version__ = '0.1.1'
+with open('bibcheck/__init__.py') as f:
+    __version__ = re.search(r"__version__ = '(.*)'", f.read()).group(1)
 
 setup(name='bibcheck',
       version=__version__,
       packages=['bibcheck'],
       include_package_data=True,
-      package_data={'': ['*.json']},
+      package_data={'': ['*.json', '*.db']},
+      extras_require={'yaml': ['PyYAML'], 'orjson': ['orjson']},
       entry_points={'console_scripts': ['bibcheck = bibcheck.main:main']}
 )
@@ -0,0 +1,113 @@
+"""The trigram indexes must find the same close matches as a full difflib
+scan, for the journals of tests/graphs.bib and misspellings of them."""
+import difflib
+import json
+import os
+import random
+
+import pytest
+
+from bibcheck import abbrevs, bib
+
+GRAPHS = os.path.join(os.path.dirname(__file__), 'graphs.bib')
+
+
+def misspell(title, rng):
+    """Returns title with a character dropped, doubled or swapped, or its
+    case changed"""
+    i = rng.randrange(len(title) - 1)
+    edit = rng.randrange(4)
+    if edit == 0:
+        return title[:i] + title[i + 1:]
+    if edit == 1:
+        return title[:i] + title[i] + title[i:]
+    if edit == 2:
+        return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+    return title.lower() if rng.randrange(2) else title.upper()
+
+
+def journals():
+    parser = bib.Bibparser(open(GRAPHS).read())
+    parser.parse()
+    titles = sorted(set(record['journal'] for record in parser.records.values() if 'journal' in record))
+    # a full difflib scan takes a while, so only check a sample
+    titles = titles[::8]
+    rng = random.Random(0)
+    return titles + [misspell(title, rng) for title in titles]
+
+
+@pytest.fixture(scope='module')
+def table():
+    with open(abbrevs.JSON_PATH) as f:
+        return abbrevs.Table(json.load(f))
+
+
+@pytest.fixture(scope='module')
+def compiled(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('db') / 'abbreviations.db')
+    abbrevs.compile_table(abbrevs.JSON_PATH, path)
+    return abbrevs.CompiledTable(path, abbrevs.table_version())
+
+
+@pytest.mark.parametrize('journal', journals())
+def test_close_matches(journal, table, compiled):
+    expected = difflib.get_close_matches(journal, table.index.strings)
+    assert table.index.get_close_matches(journal) == expected
+    assert compiled.index.get_close_matches(journal) == expected
+
+
+def test_compiled_lookups(table, compiled):
+    for s in table.index.strings[::97]:
+        assert (s in compiled.abbrevs) == (s in table.abbrevs)
+        assert compiled.full_to_abbrev.get(s) == table.full_to_abbrev.get(s)
+        assert compiled.abbrev_to_full.get(s) == table.abbrev_to_full.get(s)
+        key = abbrevs.normalize(s)
+        assert compiled.by_key.get(key) == table.by_key.get(key)
+
+
+def test_normalized_lookups(table):
+    validator = abbrevs.Validator()
+    for journal in ['journal of chemical physics', 'JOURNAL OF CHEMICAL PHYSICS',
+                    'Journal of Chemical  Physics.', 'J Chem Phys', 'j. chem. phys']:
+        assert abbrevs.normalize(journal) in table.by_key
+        assert validator.recommend(journal) == 'J. Chem. Phys.'
+    assert validator.recommend('J. Chem. Phys.') is None
+
+
+def test_first_row_wins():
+    table = abbrevs.Table([
+        ['Ann. A', 'Annals'],
+        ['Ann. B', 'Annals'],
+        ['Annals', 'Annals of Everything'],
+    ])
+    assert table.full_to_abbrev['Annals'] == 'Ann. A'
+    assert table.by_key[abbrevs.normalize('annals.')] == 'Annals'
+    assert table.by_key[abbrevs.normalize('ANNALS OF EVERYTHING')] == 'Annals'
+    assert table.abbrevs == set(['Ann. A', 'Ann. B', 'Annals'])
+
+
+def test_validator_cache():
+    validator = abbrevs.Validator(cache_size=2)
+    journals = ['Journal of Chemical Physics', 'J. Chem. Phys.', 'journal of chemical physics']
+    for journal in journals:
+        validator.validate(journal)
+    # the first journal was the least recently used
+    assert list(validator.cache) == journals[1:]
+    assert (validator.hits, validator.misses) == (0, 3)
+
+    assert validator.validate(journals[1]) is None
+    assert (validator.hits, validator.misses) == (1, 3)
+    assert list(validator.cache) == [journals[2], journals[1]]
+
+    assert validator.validate(journals[0]) == 'J. Chem. Phys.'
+    assert (validator.hits, validator.misses) == (1, 4)
+    assert list(validator.cache) == [journals[1], journals[0]]
+
+
+def test_unbounded_validator_cache():
+    validator = abbrevs.Validator()
+    for i in range(3):
+        for journal in ['Journal of Chemical Physics', 'J. Chem. Phys.']:
+            validator.validate(journal)
+    assert len(validator.cache) == 2
+    assert (validator.hits, validator.misses) == (4, 2)
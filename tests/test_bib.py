@@ -0,0 +1,112 @@
+import os
+import pickle
+from io import StringIO
+
+import pytest
+
+from bibcheck import abbrevs, bib, report, schemas
+
+GRAPHS = os.path.join(os.path.dirname(__file__), 'graphs.bib')
+
+
+def state(records):
+    return [(key, record.entry_type, dict(record), record.start_line, record.end_line, record.lines)
+            for key, record in records]
+
+
+def test_iter_records():
+    with open(GRAPHS) as f:
+        text = f.read()
+    parser = bib.Bibparser(text)
+    parser.parse()
+    records = state(bib.Bibparser('').iter_records(StringIO(text), chunk_size=1000))
+    # parse keeps the last entry of a key which occurs twice
+    assert dict((r[0], r) for r in records) == dict((r[0], r) for r in state(parser.records.items()))
+    # an entry split across chunks is parsed whole
+    assert state(bib.Bibparser('').iter_records(StringIO(text), chunk_size=7)) == records
+
+
+def test_parallel_records():
+    with open(GRAPHS) as f:
+        text = f.read()
+    records = state(bib.Bibparser('').iter_records(StringIO(text)))
+    assert state(bib.Bibparser('').iter_records(StringIO(text), jobs=2)) == records
+
+
+def test_parallel_macros():
+    # a macro redefined part way through applies from there on, in whichever
+    # batch the entries land
+    text = ''.join('@string{j = {Journal %d}}\n@article{a%d, journal = j}\n@article{b%d, journal = j}\n'
+                   % (i, i, i) for i in range(10))
+    records = list(bib.Bibparser('').iter_records(StringIO(text), jobs=2, batch_size=3))
+    assert [(key, record['journal']) for key, record in records] == \
+        [(key % i, 'Journal %d' % i) for i in range(10) for key in ('a%d', 'b%d')]
+
+def test_record():
+    parser = bib.Bibparser("""@string{gt = {Graph Theory}}
+@Article{key,
+  title = {A {B}ig Title},
+  journal = "J. " # gt,
+  year = 1990,
+  pages = {1--2},
+}
+""")
+    parser.parse()
+    record = parser.records['key']
+    assert record.entry_type == 'article'
+    assert record['title'] == 'A Big Title'
+    assert record['journal'] == 'J. Graph Theory'
+    assert record['issued'] == {'literal': '1990'}
+    assert record['page'] == '1-2'
+    assert record.text('title') == 'A {B}ig Title'
+    assert (record.start_line, record.end_line) == (2, 7)
+    assert record.lines == {'title': 3, 'journal': 4, 'issued': 5, 'page': 6}
+    copy = pickle.loads(pickle.dumps(record))
+    assert copy.entry_type == 'article'
+    assert dict(copy) == dict(record)
+
+
+def test_mapping():
+    parser = bib.Bibparser('@book{key, title = {Title}, year = {1990}}')
+    parser.parse()
+    for record in (parser.records['key'], bib.Record({'id': 'key', 'title': 'Title', 'issued': {'literal': '1990'}})):
+        assert list(record.values()) == ['key', 'Title', {'literal': '1990'}]
+        assert dict(record.items()) == {'id': 'key', 'title': 'Title', 'issued': {'literal': '1990'}}
+        assert list(record.keys()) == ['id', 'title', 'issued']
+
+
+def test_two_sources():
+    record = bib.Record()
+    record.set_source('note', 'xx{hello}', bib.Span(3, 8))
+    record.set_source('title', 'other {world}', bib.Span(7, 12))
+    assert dict(record) == {'note': 'hello', 'title': 'world'}
+    # a field of the first source, set again from the second
+    record.set_source('note', 'x{bye}', bib.Span(2, 5))
+    record['year'] = '1990'
+    assert dict(record) == {'note': 'bye', 'title': 'world', 'year': '1990'}
+    assert record.text('title') == 'world'
+
+
+def test_validate_records_without_lines():
+    record = bib.Record({'title': 'T', 'journal': 'Journal of Chemical Physics'}, entry_type='misc')
+    parsed = bib.Bibparser('@misc{parsed, title = {T}}')
+    parsed.parse()
+    parsed.records['parsed']['journal'] = 'Journal of Chemical Physics'
+    collector = report.Collector()
+    counts = bib.Bibparser('').validate(schemas.load('ACS'), abbrevs.Validator(), reporter=collector,
+                                        records=[('api', record), ('parsed', parsed.records['parsed'])])
+    assert counts == {'entries': 2, 'errors': 0, 'warnings': 2}
+    # reported on the entry's line, if any
+    assert [(d.key, d.line) for d in collector.items if getattr(d, 'field', None) == 'journal'] == \
+        [('api', None), ('parsed', 1)]
+
+
+@pytest.mark.parametrize('title, expected', [
+    ('A {B}ig Title', 'A Big Title'),
+    ("Tutte's theorem (in Japanese)", "Tutte's theorem (in Japanese)"),
+    ('{NP}-completeness of {Hamiltonian} cycles, {a {nested} group}', 'NP-completeness of Hamiltonian cycles, A Nested Group'),
+])
+def test_title(title, expected):
+    parser = bib.Bibparser('@article{key, title = {%s}}' % title)
+    parser.parse()
+    assert parser.records['key']['title'] == expected
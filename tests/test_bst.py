@@ -0,0 +1,110 @@
+import os
+import threading
+from io import StringIO
+
+import pytest
+
+from bibcheck import bib, bst
+
+HERE = os.path.dirname(__file__)
+
+TECHREPORTS = """@techreport{plain,
+  author = {Ann Smith},
+  title = {Plain},
+  institution = {Univ},
+  number = {1},
+  year = {1990},
+}
+@techreport{typed,
+  author = {Ann Smith},
+  title = {Typed},
+  institution = {Univ},
+  number = {1},
+  type = {Research Note},
+  year = {1990},
+}
+"""
+
+
+def read(name):
+    with open(os.path.join(HERE, name)) as f:
+        return f.read()
+
+
+@pytest.fixture(scope='module')
+def style():
+    return bst.compile(read('IEEE.bst'))
+
+
+@pytest.fixture(scope='module')
+def graphs():
+    return read('graphs.bib')
+
+
+@pytest.fixture(scope='module')
+def output(style, graphs):
+    return bst.Interpreter(style, log=StringIO()).format(graphs)
+
+
+def test_type_field(style):
+    out = bst.format_bibliography(style, TECHREPORTS)
+    assert '\\newblock Tech. {R}ep.~1, Univ, 1990.' in out
+    assert '\\newblock Research Note~1, Univ, 1990.' in out
+    parser = bib.Bibparser(TECHREPORTS)
+    parser.parse()
+    assert parser.records['typed'].entry_type == 'techreport'
+    assert parser.records['typed']['type'] == 'Research Note'
+    assert 'type' not in parser.records['plain']
+
+
+def test_output(output):
+    assert output.startswith('\\begin{thebibliography}{1000}\n')
+    assert output.endswith('\\end{thebibliography}\n')
+    assert output.count('\\bibitem{') == 1457
+
+
+def test_shared_style(style, graphs, output):
+    # a Style is never modified, so interpreters can share it
+    outputs = [None] * 2
+
+    def run(i):
+        outputs[i] = bst.Interpreter(style, log=StringIO()).format(graphs)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outputs == [output] * 2
+    assert bst.Interpreter(style, log=StringIO()).format(graphs) == output
+
+
+def test_parallel_iterate(style, graphs, output):
+    assert bst.Interpreter(style, log=StringIO(), jobs=2).format(graphs) == output
+
+
+def test_entry_local(style):
+    commands = [f for command, f in style.commands if command == 'iterate']
+    types = [style.functions[type] for type in ('article', 'book', 'techreport', 'misc')]
+    # carries the longest label from one entry to the next
+    assert bst.entry_local(commands[0], types) is None
+    assert bst.entry_local(commands[1], types) is not None
+
+
+def test_streamed(style, graphs, output):
+    chunks = list(bst.Interpreter(style, log=StringIO()).iter_format(graphs))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == output
+    out = StringIO()
+    assert bst.Interpreter(style, log=StringIO()).format(graphs, out) is None
+    assert out.getvalue() == output
+
+
+def test_trace(style, graphs, output):
+    trace = bst.Trace()
+    assert bst.Interpreter(style, log=StringIO(), trace=trace).format(graphs) == output
+    assert trace.calls['output.bibitem'] == 1457
+    assert trace.builtins[bst.BUILTINS['cite$']] >= 1457
+    assert trace.ops[bst.CALL] > 0
+    report = StringIO()
+    trace.report(report)
+    assert 'output.bibitem' in report.getvalue()
@@ -0,0 +1,83 @@
+import os
+from io import StringIO
+
+import pytest
+
+from bibcheck import abbrevs, bib, cache, schemas
+
+GRAPHS = os.path.join(os.path.dirname(__file__), 'graphs.bib')
+
+
+@pytest.fixture(scope='module')
+def journal_validator():
+    return abbrevs.Validator()
+
+
+def validate(text, result_cache, journal_validator):
+    parser = bib.Bibparser(text)
+    parser.parse()
+    out = StringIO()
+    counts = parser.validate(schemas.load('ACS'), journal_validator, out=out, cache=result_cache)
+    return counts, out.getvalue()
+
+
+def test_reuse(tmp_path, journal_validator):
+    with open(GRAPHS) as f:
+        text = f.read()
+    path = str(tmp_path / 'cache' / 'graphs.json')
+    schema = schemas.load('ACS')
+    version = journal_validator.version
+
+    first = cache.ResultCache(path, schema, version)
+    expected = validate(text, None, journal_validator)
+    assert validate(text, first, journal_validator) == expected
+    assert first.hits == 0
+    first.save()
+
+    second = cache.ResultCache(path, schema, version)
+    assert validate(text, second, journal_validator) == expected
+    assert second.misses == 0
+
+    # only the edited entry is checked again
+    edited = text.replace('journal = {ACM Transactions on Mathematical\nSoftware}', 'journal = {ACM Trans. Math. Software}')
+    assert edited != text
+    third = cache.ResultCache(path, schema, version)
+    assert validate(edited, third, journal_validator) == validate(edited, None, journal_validator)
+    assert third.misses == 1
+
+
+def test_key(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / 'c.json'), schemas.load('ACS'), 'v')
+    article = bib.Record({'title': 'T'}, entry_type='article')
+    book = bib.Record({'title': 'T'}, entry_type='book')
+    assert result_cache.key(article) == result_cache.key(bib.Record({'title': 'T'}, entry_type='article'))
+    assert result_cache.key(article) != result_cache.key(book)
+    other = cache.ResultCache(str(tmp_path / 'c.json'), schemas.load('ACS'), 'w')
+    assert other.key(article) != result_cache.key(article)
+
+
+def test_stale_files_are_ignored(tmp_path):
+    path = tmp_path / 'c.json'
+    path.write_text('{"format": 0, "results": {"x": {}}}')
+    assert cache.ResultCache(str(path), schemas.load('ACS'), 'v').results == {}
+    path.write_text('not json')
+    assert cache.ResultCache(str(path), schemas.load('ACS'), 'v').results == {}
+
+
+def test_concurrent_saves(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache' / 'c.json')
+    schema = schemas.load('ACS')
+    first, second = [cache.ResultCache(path, schema, 'v') for i in range(2)]
+    first.put('first', {'missing': [], 'journal': None})
+    second.put('second', {'missing': [], 'journal': None})
+    replace = cache._replace
+
+    def save_second_first(src, dst):
+        # the second run saves while the first is writing
+        monkeypatch.setattr(cache, '_replace', replace)
+        second.save()
+        replace(src, dst)
+    monkeypatch.setattr(cache, '_replace', save_second_first)
+    first.save()
+    assert list(cache.ResultCache(path, schema, 'v').results) == ['first']
+    assert os.listdir(str(tmp_path / 'cache')) == ['c.json']
@@ -0,0 +1,85 @@
+import json
+import os
+from io import StringIO
+
+import pytest
+
+from bibcheck import bib, csl
+
+GRAPHS = os.path.join(os.path.dirname(__file__), 'graphs.bib')
+
+REPORT = r"""@techreport{obrien90,
+  author = {Patrick O'Brien and Jos{\'e} M{\"u}ller and {\v{S}}imon Ne\v{s}et\v{r}il
+            and {Barnes and Noble}},
+  title = {Graphs and trees in {C}\'ordoba: {NP}-hard problems},
+  institution = {Universit\"at des Saarlandes},
+  type = {Research Report},
+  number = {17},
+  year = {1990},
+  month = jun,
+  pages = {1--10},
+}
+"""
+
+
+def records(text):
+    return list(bib.Bibparser('').iter_records(StringIO(text)))
+
+
+def strings(value):
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for v in value:
+            for s in strings(v):
+                yield s
+    elif isinstance(value, str):
+        yield value
+
+
+def test_item():
+    (key, record), = records(REPORT)
+    assert csl.item(key, record) == {
+        'id': 'obrien90',
+        'type': 'report',
+        'author': [
+            {'family': "O'Brien", 'given': 'Patrick'},
+            {'family': 'Müller', 'given': 'José'},
+            {'family': 'Nešetřil', 'given': 'Šimon'},
+            {'family': 'Barnes and Noble'},
+        ],
+        'title': 'Graphs and trees in Córdoba: NP-hard problems',
+        'publisher': 'Universität des Saarlandes',
+        'genre': 'Research Report',
+        'number': '17',
+        'issued': {'date-parts': [[1990, 6]]},
+        'page': '1-10',
+    }
+
+
+@pytest.mark.parametrize('text, expected', [
+    (r"{\em Graphs} of $\log n$ depth", 'Graphs of log n depth'),
+    (r"Bj{\o}rn {\AA}ke {\ss} \c{c}a\~n", 'Bjørn Åke ß çañ'),
+    (r"Ji{\v{r}}\'{\i} Matou{\v{s}}ek", 'Jiří Matoušek'),
+    (r"1990--1995, A~B \& C\\D", '1990–1995, A B & C D'),
+])
+def test_plain_text(text, expected):
+    assert csl.plain_text(text) == expected
+
+
+def test_round_trip():
+    pairs = records(open(GRAPHS).read())
+    items = [csl.item(key, record) for key, record in pairs]
+    for backend in csl.BACKENDS:
+        if backend == 'orjson' and csl.orjson is None:
+            continue
+        assert json.loads(csl.dumps(pairs, backend)) == items
+    # the type is the entry type, and a type field the genre
+    for item, (key, record) in zip(items, pairs):
+        assert item['type'] == csl.TYPES.get(record.entry_type, 'document')
+    assert sum(item['type'] == 'report' for item in items) == 114
+    assert sum('genre' in item for item in items) == sum('type' in record for key, record in pairs)
+    # no LaTeX left
+    for item in items:
+        for s in strings(item):
+            assert not set('{}\\$') & set(s), (item['id'], s)
@@ -0,0 +1,84 @@
+import os
+from io import StringIO
+
+import pytest
+
+from bibcheck import bib, incremental
+
+GRAPHS = os.path.join(os.path.dirname(__file__), 'graphs.bib')
+
+STRINGS = """@string{jgt = {Journal of Graph Theory}}
+
+@article{a, author = {A. Author}, title = {First}, journal = jgt, year = {1990}}
+
+@article{b, author = {B. Author}, title = {Second}, journal = jgt, year = {1991}}
+"""
+
+
+@pytest.fixture(scope='module')
+def text():
+    with open(GRAPHS) as f:
+        return f.read()
+
+
+def state(records):
+    """What a parse gives: the keys, entry types, fields and lines"""
+    return [(key, record.entry_type, dict(record), record.start_line, record.end_line, record.lines)
+            for key, record in records]
+
+
+def parse(text):
+    # like Document, and unlike Bibparser.parse, keeps both entries of a
+    # key which occurs twice
+    return state(bib.Bibparser('').iter_records(StringIO(text)))
+
+
+def check(document, text):
+    assert state(document.update(text)) == parse(text)
+
+
+def test_edit(text):
+    document = incremental.Document()
+    check(document, text)
+    assert document.n_parsed == document.n_entries
+
+    edited = text.replace('title = {The multifrontal solution', 'title = {The\nmultifrontal solution')
+    assert edited != text
+    check(document, edited)
+    assert document.n_parsed == 1
+    assert [key for key, record in document.changed] == ['DuffR83']
+
+    check(document, edited)
+    assert document.n_parsed == 0
+
+
+def test_insert_and_delete(text):
+    document = incremental.Document()
+    document.update(text)
+    start = text.index('@', len(text) // 2)
+    entry = '@misc{new, title = {New}}\n\n'
+    inserted = text[:start] + entry + text[start:]
+    check(document, inserted)
+    # the entry before the insertion is split again too
+    assert document.n_parsed <= 2
+    check(document, text)
+    assert document.n_parsed <= 2
+
+
+def test_string_edit():
+    document = incremental.Document()
+    check(document, STRINGS)
+    # changes the journal of every entry after it
+    check(document, STRINGS.replace('Journal of Graph Theory', 'J. Graph Theory'))
+    assert [record['journal'] for key, record in document.records] == ['J. Graph Theory'] * 2
+
+
+def test_results_are_dropped():
+    document = incremental.Document()
+    records = document.update(STRINGS)
+    for key, record in records:
+        document.put(document.key(record), {'missing': [], 'journal': None})
+    records = document.update(STRINGS.replace('Second', 'Third'))
+    assert document.get(document.key(records[0][1])) is not None
+    assert document.get(document.key(records[1][1])) is None
+    assert (document.hits, document.misses) == (1, 1)
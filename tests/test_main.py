@@ -0,0 +1,98 @@
+import json
+import sys
+
+import pytest
+
+from bibcheck import main
+
+GOOD = """@book{good, author = {A. Author}, title = {Good}, year = {1990}}
+"""
+
+BAD = """@article{bad, author = {B. Author}, title = {Bad}, journal = {Journal of Chemical Physics}, year = {1991}}
+@book{fine, author = {C. Author}, title = {Fine}, year = {1992}}
+"""
+
+
+def run(monkeypatch, capsys, *argv):
+    monkeypatch.setattr(sys, 'argv', ['bibcheck', '--no-cache'] + list(argv))
+    status = main.main()
+    return status, capsys.readouterr().out
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / 'good.bib').write_text(GOOD)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'bad.bib').write_text(BAD)
+    return tmp_path
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_several_files(files, monkeypatch, capsys, jobs):
+    status, out = run(monkeypatch, capsys, '-j', jobs, '--format', 'jsonl', str(files))
+    lines = [json.loads(line) for line in out.splitlines()]
+    good, bad = str(files / 'good.bib'), str(files / 'sub' / 'bad.bib')
+    summaries = [(line.get('file'), line['summary']) for line in lines if 'summary' in line]
+    assert summaries == [
+        (good, {'entries': 1, 'errors': 0, 'warnings': 0}),
+        (bad, {'entries': 2, 'errors': 3, 'warnings': 1}),
+        (None, {'entries': 3, 'errors': 3, 'warnings': 1, 'files': 2}),
+    ]
+    assert [(line['file'], line['key'], line['field']) for line in lines if 'code' in line] == [
+        (bad, 'bad', 'volume'), (bad, 'bad', 'page'), (bad, 'bad', 'doi'), (bad, 'bad', 'journal')]
+    assert status == 1
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_exit_status(files, monkeypatch, capsys, jobs):
+    good = str(files / 'good.bib')
+    (files / 'other.bib').write_text(GOOD.replace('good', 'other'))
+    status, out = run(monkeypatch, capsys, '-j', jobs, good, str(files / 'other.bib'))
+    assert status == 0
+    assert out.endswith('Files validated: 2, entries validated: 2, errors: 0, warnings: 0\n')
+
+    # a file which cannot be read fails the run, but not the other files
+    (files / 'broken.bib').write_bytes(b'@book{x, title = {\xff}}\n')
+    status, out = run(monkeypatch, capsys, '-j', jobs, good, str(files / 'broken.bib'))
+    assert status == 1
+    assert 'Files validated: 1, entries validated: 1' in out
+    assert 'Files that could not be validated: 1' in out
+
+
+def test_single_file(files, monkeypatch, capsys):
+    assert run(monkeypatch, capsys, str(files / 'good.bib'))[0] == 0
+    assert run(monkeypatch, capsys, str(files / 'sub' / 'bad.bib'))[0] == 1
+
+
+class Stop(Exception):
+    pass
+
+
+def test_watch(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'refs.bib'
+    path.write_text(BAD)
+    monkeypatch.setattr(sys, 'argv', ['bibcheck', '--watch', str(path)])
+    args = main.parse_cmd_line()
+    outputs = []
+
+    def sleep(interval):
+        # what each look at the file printed
+        assert interval == args.interval
+        outputs.append(capsys.readouterr().out)
+        if len(outputs) == 3:
+            # the size changes with the edit, whatever the mtime resolution
+            path.write_text(BAD.replace('{Fine}', '{Fine, Revised}'))
+        elif len(outputs) == 6:
+            raise Stop()
+
+    with pytest.raises(Stop):
+        main.watch(str(path), args, sleep=sleep)
+    first, checked, unchanged, edited, rechecked, again = outputs
+    # a new or edited file is only checked once it stays the same for an interval
+    assert first == edited == ''
+    assert '"bad" is missing field "volume"' in checked
+    assert 'Entries validated: 2' in checked
+    assert unchanged == again == ''
+    assert 'changed: 1 of 2 entries parsed' in rechecked
+    assert '"bad"' not in rechecked
+    assert 'Entries validated: 1' in rechecked
@@ -0,0 +1,53 @@
+import pytest
+
+from bibcheck import bib, names
+from bibcheck.names import Name
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('Ludwig van Beethoven', Name('Ludwig', 'van', 'Beethoven', '')),
+    ('Ford, Jr., Henry', Name('Henry', '', 'Ford', 'Jr.')),
+    ('de la Fontaine, Jean', Name('Jean', 'de la', 'Fontaine', '')),
+    ("Patrick O'Brien", Name('Patrick', '', "O'Brien", '')),
+    ("Jos{\\'e} M{\\\"u}ller", Name("Jos{\\'e}", '', 'M{\\"u}ller', '')),
+    # a control sequence gives its case to a braced group
+    ("Charles Louis Xavier Joseph {\\'e}tienne de la Vall{\\'e}e Poussin",
+     Name('Charles Louis Xavier Joseph', "{\\'e}tienne de la", "Vall{\\'e}e Poussin", '')),
+    ('{Barnes and Noble}', Name('', '', '{Barnes and Noble}', '')),
+    ('{\\AA}ke {\\O}stlund', Name('{\\AA}ke', '', '{\\O}stlund', '')),
+])
+def test_parse_name(name, expected):
+    assert names.parse_name(name) == expected
+
+
+def test_split_names():
+    assert names.split_names('A and {B and C} and D AND E') == ('A', '{B and C}', 'D', 'E')
+    assert names.split_names('  ') == ()
+
+
+@pytest.mark.parametrize('name, fmt, expected', [
+    ('Donald Ervin Knuth', '{f.~}{vv~}{ll}{, jj}', 'D.~E. Knuth'),
+    ('Ludwig van Beethoven', '{vv~}{ll}{, f.}', 'van Beethoven, L.'),
+    ("Jos{\\'e} M{\\\"u}ller", '{f.~}{ll}', "J.~M{\\\"u}ller"),
+])
+def test_format_name(name, fmt, expected):
+    assert names.format_name(name, fmt) == expected
+
+
+def test_authors_from_source():
+    parser = bib.Bibparser("""@article{x,
+  author = {Patrick O'Brien and Jos{\\'e} M{\\"u}ller and {Barnes and Noble}},
+  title = {T},
+}
+@article{y, author = "Ford, Jr., Henry and de la Fontaine, Jean"}
+""")
+    parser.parse()
+    assert [dict(author) for author in parser.records['x']['author']] == [
+        {'family': "O'Brien", 'given': 'Patrick'},
+        {'family': 'M{\\"u}ller', 'given': "Jos{\\'e}"},
+        {'family': '{Barnes and Noble}'},
+    ]
+    assert [dict(author) for author in parser.records['y']['author']] == [
+        {'family': 'Ford', 'given': 'Henry', 'suffix': 'Jr.'},
+        {'family': 'Fontaine', 'given': 'Jean', 'non-dropping-particle': 'de la'},
+    ]
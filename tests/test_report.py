@@ -0,0 +1,86 @@
+import json
+import os
+from io import StringIO
+
+import pytest
+
+from bibcheck import abbrevs, bib, report, schemas
+
+GRAPHS = os.path.join(os.path.dirname(__file__), 'graphs.bib')
+
+LEVELS = ('none', 'note', 'warning', 'error')
+
+
+@pytest.fixture(scope='module')
+def journal_validator():
+    return abbrevs.Validator()
+
+
+def validate(reporter, journal_validator, path=GRAPHS):
+    parser = bib.Bibparser(open(path).read())
+    parser.parse()
+    reporter.start_file(path)
+    counts = parser.validate(schemas.load('ACS'), journal_validator, reporter=reporter)
+    reporter.close()
+    return counts
+
+
+def check_sarif(log):
+    """Checks the properties the SARIF 2.1.0 schema requires, and the values
+    it allows, of the parts of a log bibcheck writes"""
+    assert log['version'] == '2.1.0'
+    assert log['$schema'].endswith('sarif-2.1.0.json')
+    assert isinstance(log['runs'], list) and log['runs']
+    for run in log['runs']:
+        driver = run['tool']['driver']
+        assert isinstance(driver['name'], str)
+        rules = set()
+        for rule in driver['rules']:
+            assert isinstance(rule['id'], str)
+            assert rule['defaultConfiguration']['level'] in LEVELS
+            rules.add(rule['id'])
+        assert isinstance(run['results'], list)
+        for result in run['results']:
+            assert isinstance(result['message']['text'], str)
+            assert result['ruleId'] in rules
+            assert result['level'] in LEVELS
+            for location in result.get('locations', []):
+                physical = location['physicalLocation']
+                assert isinstance(physical['artifactLocation']['uri'], str)
+                if 'region' in physical:
+                    assert physical['region']['startLine'] >= 1
+            assert isinstance(result.get('properties', {}), dict)
+
+
+def test_sarif(journal_validator):
+    out = StringIO()
+    counts = validate(report.SarifReporter(out), journal_validator)
+    log = json.loads(out.getvalue())
+    check_sarif(log)
+    results = log['runs'][0]['results']
+    assert sum(result['level'] == 'error' for result in results) == counts['errors']
+    assert sum(result['level'] == 'warning' for result in results) == counts['warnings']
+    assert log['runs'][0]['tool']['driver']['name'] == 'bibcheck'
+
+
+def test_sarif_without_results():
+    out = StringIO()
+    report.SarifReporter(out).close()
+    log = json.loads(out.getvalue())
+    check_sarif(log)
+    assert log['runs'][0]['results'] == []
+
+
+def test_jsonl(journal_validator):
+    out = StringIO()
+    counts = validate(report.JsonLinesReporter(out), journal_validator)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines[-1] == {'summary': counts, 'file': GRAPHS}
+    assert sum(line.get('level') == 'error' for line in lines) == counts['errors']
+
+
+def test_max_errors(journal_validator):
+    out = StringIO()
+    counts = validate(report.TextReporter(out, max_errors=5), journal_validator)
+    assert counts['errors'] >= 5
+    assert out.getvalue().count('ERROR') == counts['errors']
@@ -0,0 +1,70 @@
+import multiprocessing
+import pickle
+
+from bibcheck import bib, schemas
+
+ARTICLE = """@article{knuth,
+  author = {Donald E. Knuth},
+  title = {The Art of Computer Programming},
+  journal = {Commun. ACM},
+  year = {1968},
+  pages = {1--10},
+}
+"""
+
+
+def parse(text):
+    parser = bib.Bibparser(text)
+    parser.parse()
+    return parser.records['knuth']
+
+
+def test_bibtex_field_names(tmp_path):
+    path = tmp_path / 'venue.yaml'
+    path.write_text('article:\n  required: [author, title, journal, year, pages]\n')
+    schema = schemas.load(str(path))
+    assert schema.missing(parse(ARTICLE)) == []
+    record = parse(ARTICLE.replace('  year = {1968},\n', '').replace('  pages = {1--10},\n', ''))
+    assert schema.missing(record) == ['year', 'pages']
+
+
+def test_renamed_fields_are_one_field():
+    record = parse(ARTICLE.replace('  pages = {1--10},\n', ''))
+    schema = schemas.compile([{'article': ['pages', 'title']}, {'article': ['page', 'year']}])
+    assert schema.missing(record) == [('pages', ['schema 1', 'schema 2'])]
+    assert schemas.Schema({'article': ['page', 'pages']}).missing(record) == ['page']
+
+
+def test_type_field():
+    record = parse(ARTICLE.replace('  year = {1968},\n', '  type = {Letter},\n'))
+    assert record.entry_type == 'article'
+    assert schemas.Schema({'article': ['year', 'type']}).missing(record) == ['year']
+    assert schemas.Schema({'letter': ['year']}).missing(record) is None
+
+
+def test_capitalized_field_names(tmp_path):
+    record = parse(ARTICLE.replace('  year', '  Year').replace('  pages', '  PAGES'))
+    assert record['issued'] == {'literal': '1968'}
+    assert record['page'] == '1-10'
+    path = tmp_path / 'venue.yaml'
+    path.write_text('article:\n  required: [author, title, journal, year, pages]\n')
+    assert schemas.load(str(path)).missing(record) == []
+    assert schemas.Schema({'article': ['Year', 'Pages', 'Volume']}).missing(record) == ['volume']
+
+
+def missing_elsewhere(data):
+    # a new process numbers the fields in the order it meets them
+    for name in ('zz%d' % i for i in range(40)):
+        schemas.field_bit(name)
+    return pickle.loads(data).missing(parse(ARTICLE))
+
+
+def test_pickled_schema_set():
+    schema = schemas.compile([schemas.load('ACS'), {'article': ['journal', 'zz7']}])
+    expected = [('volume', ['ACS']), ('doi', ['ACS']), ('zz7', ['schema 2'])]
+    assert schema.missing(parse(ARTICLE)) == expected
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        assert pool.apply(missing_elsewhere, (pickle.dumps(schema),)) == expected
+    finally:
+        pool.terminate()
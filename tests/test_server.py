@@ -0,0 +1,69 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from bibcheck import schemas, server
+
+ARTICLE = """@article{knuth,
+  author = {Donald E. Knuth},
+  title = {The Art of Computer Programming},
+  journal = {Commun. ACM},
+  year = {1968},
+}
+"""
+
+
+def test_regular_file_is_kept(tmp_path):
+    path = str(tmp_path / 'notes.txt')
+    with open(path, 'w') as f:
+        f.write('notes')
+    with pytest.raises(ValueError, match='not a socket'):
+        server.Server(path, schemas.load('ACS'))
+    with open(path) as f:
+        assert f.read() == 'notes'
+
+
+def test_stale_socket_is_removed(tmp_path):
+    path = str(tmp_path / 'bibcheck.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    # closed without listening or removing the file, as after a crash
+    sock.close()
+    server.remove_stale_socket(path)
+    assert not os.path.exists(path)
+    server.remove_stale_socket(path)
+
+
+def test_other_users_socket(tmp_path, monkeypatch):
+    path = str(tmp_path / 'bibcheck.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+    monkeypatch.setattr(os, 'getuid', lambda uid=os.getuid(): uid + 1)
+    with pytest.raises(ValueError, match='another user'):
+        server.remove_stale_socket(path)
+    assert os.path.exists(path)
+    with pytest.raises(ValueError, match='another user'):
+        server.request(path, str(tmp_path / 'refs.bib'), ARTICLE)
+
+
+def test_running_server(tmp_path):
+    path = str(tmp_path / 'bibcheck.sock')
+    srv = server.Server(path, schemas.load('ACS'))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.start()
+    try:
+        with pytest.raises(ValueError, match='already running'):
+            server.Server(path, schemas.load('ACS'))
+        assert srv.journal_validator.cache_size == server.CACHE_SIZE
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        response = server.request(path, str(tmp_path / 'refs.bib'), ARTICLE)
+        assert response['summary'] == {'entries': 1, 'errors': 3, 'warnings': 0}
+        assert '"knuth" is missing field "volume"' in response['report']
+    finally:
+        srv.shutdown()
+        thread.join()
+        srv.server_close()
+    assert not os.path.exists(path)
@@ -0,0 +1,325 @@
+"""Micro-benchmarks for bibcheck.
+
+    python tools/benchmark.py tokenize [file.bib]
+    python tools/benchmark.py memory [--copies N] [file.bib]
+    python tools/benchmark.py titles [--groups N]
+    python tools/benchmark.py authors [file.bib]
+    python tools/benchmark.py export [file.bib]
+    python tools/benchmark.py bst [--style file.bst] [--copies N] [-j N] [--trace] [file.bib]
+"""
+from __future__ import print_function
+import functools
+import multiprocessing
+import os
+import re
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from io import StringIO
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bibcheck import bib
+from bibcheck import bst
+from bibcheck import csl
+from bibcheck import names
+
+GRAPHS = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'graphs.bib')
+IEEE = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'IEEE.bst')
+
+
+def read(fn):
+    with open(fn) as f:
+        return os.linesep.join(l.strip() for l in f)
+
+
+def best_of(f, repeat=5):
+    """Returns the fastest of repeat runs of f, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def old_tokenize(data):
+    """The tokenizer Bibparser used before it had a single master regex"""
+    white = re.compile(r"[\n|\s]+")
+    nl = re.compile(r"[\n]")
+    token_re = re.compile(r"([^\s\"#'(){}@,=]+|\n|@|\"|{|}|=|,)")
+    line = 1
+    for item in token_re.finditer(data):
+        i = item.group(0)
+        if white.match(i):
+            if nl.match(i):
+                line += 1
+            continue
+        else:
+            yield i
+
+
+def tokenize(args):
+    data = read(args.bibtex)
+    old = list(old_tokenize(data))
+    new = [token for _, token, _ in bib.Bibparser(data).tokenize()]
+    assert old == new, 'tokenizers disagree'
+
+    before = best_of(lambda: sum(1 for _ in old_tokenize(data)))
+    after = best_of(lambda: sum(1 for _ in bib.Bibparser(data).tokenize()))
+    print('%d tokens' % len(new))
+    print('before: %10.0f tokens/s' % (len(new) / before))
+    print('after:  %10.0f tokens/s' % (len(new) / after))
+
+
+def legacy(record):
+    """Returns record as it was stored before bib.Record had shapes: a dict,
+    with a dict of field lines and a dict per author"""
+    fields = dict(record)
+    if 'author' in fields:
+        fields['author'] = [dict(author) for author in fields['author']]
+    return fields, dict(record.lines)
+
+
+def traced(f):
+    """Returns the memory allocated by f and still held by its result, in bytes"""
+    tracemalloc.start()
+    try:
+        result = f()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def memory(args):
+    data = read(args.bibtex) * args.copies
+    parse = lambda: bib.Bibparser('').iter_records(StringIO(data))
+    n = sum(1 for _ in parse())
+    before = traced(lambda: [(key, legacy(record)) for key, record in parse()])
+    after = traced(lambda: list(parse()))
+    print('%d records' % n)
+    print('before: %6.1f MB, %4d bytes/record' % (before / 1e6, before / n))
+    print('after:  %6.1f MB, %4d bytes/record' % (after / 1e6, after / n))
+
+
+def old_capitalize_title(val):
+    """The title capitalization Bibparser.record did before it had a scanner"""
+    def capitalize(s):
+        return s.group(1) + s.group(2).upper()
+    while val.find('{') > -1:
+        caps = (val.find('{'), val.find('}'))
+        val = val.replace(val[caps[0]:caps[1]+1], re.sub(r"(^|\s)(\S)", capitalize, val[caps[0]+1:caps[1]]).strip())
+    return val
+
+
+def titles(args):
+    # as Bibparser.value joins the tokens, with the braces set off by spaces
+    title = ' '.join('on the { ACR%d } of { graph %d }' % (i, i) for i in range(args.groups))
+    assert old_capitalize_title(title) == bib.capitalize_title(title), 'capitalizations disagree'
+
+    for groups in (10, args.groups // 10, args.groups):
+        t = ' '.join(title.split(' on ')[:groups])
+        before = best_of(lambda: old_capitalize_title(t))
+        after = best_of(lambda: bib.capitalize_title(t))
+        print('%5d groups: before %8.3f ms, after %8.3f ms' % (2 * groups, before * 1e3, after * 1e3))
+
+
+def old_parse_authors(authors):
+    """The author splitting Bibparser did before it had a name parser"""
+    res = []
+    for author in authors.split(' and '):
+        _author = author.split(',')
+        rec = {'family': _author[0].strip()}
+        if len(_author) > 1:
+            rec['given'] = _author[1].strip()
+        res.append(rec)
+    return res
+
+
+def authors(args):
+    fields = []
+    for key, record in bib.Bibparser('').iter_records(StringIO(read(args.bibtex))):
+        raw = record.raw().get('author')
+        if raw is not None and raw[0] == 'source':
+            fields.append(bib.decode(raw[1]))
+    n = sum(len(names.split_names(field)) for field in fields)
+
+    def cold():
+        names.split_names.cache_clear()
+        names.parse_name.cache_clear()
+        for field in fields:
+            bib.parse_authors(field)
+
+    before = best_of(lambda: [old_parse_authors(field) for field in fields])
+    uncached = best_of(cold)
+    cached = best_of(lambda: [bib.parse_authors(field) for field in fields])
+    print('%d author fields, %d names, %d distinct' % (len(fields), n, names.parse_name.cache_info().currsize))
+    print('split on " and ": %8.0f names/s' % (n / before))
+    print('parser, uncached: %8.0f names/s' % (n / uncached))
+    print('parser, cached:   %8.0f names/s' % (n / cached))
+
+
+def export(args):
+    records = list(bib.Bibparser('').iter_records(StringIO(read(args.bibtex))))
+    for key, record in records:
+        # decode the fields up front, so that only the export is timed
+        dict(record)
+    items = [csl.item(key, record) for key, record in records]
+    print('%d records' % len(records))
+    print('item:             %8.0f records/s' % (len(records) / best_of(
+        lambda: [csl.item(key, record) for key, record in records])))
+    for backend in csl.BACKENDS:
+        try:
+            dumps = csl.serializer(backend)
+        except ValueError as e:
+            print('%-6s %s' % (backend, e))
+            continue
+        print('%-6s serialize:  %8.0f records/s' % (backend, len(records) / best_of(
+            lambda: [dumps(item) for item in items])))
+        print('%-6s dump:       %8.0f records/s' % (backend, len(records) / best_of(
+            lambda: csl.dump(records, StringIO(), backend))))
+
+
+class TreeWalker(bst.Bstparser):
+    """Runs FUNCTIONs the way Bstparser did before it compiled them: the
+    token lists are grouped and their names resolved on every call"""
+
+    def compile(self, block, code=None):
+        return [(bst.BUILTIN, lambda vm: self.walk(vm, block))]
+
+    def walk(self, vm, block):
+        for node in self.group(block):
+            if isinstance(node, list):
+                vm.push(bst.Function('{}', self.compile(node)))
+            elif isinstance(node, tuple):
+                if node[0] == ':=':
+                    vm.push(bst.Variable(node[1], node[1] in self.style.entry_vars))
+                    bst.BUILTINS[':='](vm)
+                elif node[0] == 'if$':
+                    self.walk_operand(vm, node[1] if vm.pop_int() > 0 else node[2])
+                else:
+                    while True:
+                        self.walk_operand(vm, node[1])
+                        if vm.pop_int() <= 0:
+                            break
+                        self.walk_operand(vm, node[2])
+            elif node[0] == '"':
+                vm.push(node[1:-1])
+            elif node[0] == '#':
+                vm.push(int(node[1:]))
+            elif node[0] == "'":
+                vm.push(self.literal(node[1:].lower()))
+            else:
+                code = []
+                self.emit_name(node.lower(), code)
+                vm.run(code)
+
+    def walk_operand(self, vm, node):
+        if isinstance(node, list):
+            self.walk(vm, node)
+        else:
+            vm.call(self.literal(node[1:].lower()))
+
+
+def format_bibliography(parser_class, style, data):
+    parser = parser_class(style, data)
+    parser.parse()
+    return parser, parser.output
+
+
+def bst_(args):
+    with open(args.style) as f:
+        style = f.read()
+    with open(args.bibtex) as f:
+        data = f.read()
+    stderr = sys.stderr
+    # leave out the warning$ messages
+    sys.stderr = StringIO()
+    try:
+        parser, compiled = format_bibliography(bst.Bstparser, style, data)
+        walked = format_bibliography(TreeWalker, style, data)[1]
+        assert compiled == walked, 'outputs differ'
+        n = len(parser.entries)
+        read = best_of(lambda: bib.Bibparser(data).parse(), repeat=3)
+        before = best_of(lambda: format_bibliography(TreeWalker, style, data), repeat=3)
+        after = best_of(lambda: format_bibliography(bst.Bstparser, style, data), repeat=3)
+
+        # ITERATE on args.jobs processes
+        iterating = functools.partial(bst.Bstparser, jobs=args.jobs)
+        assert format_bibliography(iterating, style, data)[1] == compiled, 'outputs of parallel ITERATE differ'
+        parallel = best_of(lambda: format_bibliography(iterating, style, data), repeat=3)
+
+        # one compiled style shared by concurrent jobs
+        compiled_style = bst.compile(style)
+        with open(os.devnull, 'w') as devnull:
+            streamed = best_of(lambda: bst.format_bibliography(compiled_style, data, out=devnull), repeat=3)
+        trace = bst.Trace()
+        assert bst.format_bibliography(compiled_style, data, trace=trace) == compiled, 'traced output differs'
+        traced = best_of(lambda: bst.format_bibliography(compiled_style, data, trace=bst.Trace()), repeat=3)
+        jobs = [data] * args.copies
+        f = functools.partial(bst.format_bibliography, compiled_style)
+        pools = [('threads', ThreadPool(args.jobs)), ('processes', multiprocessing.Pool(args.jobs))]
+        concurrent = []
+        for name, pool in pools:
+            start = time.time()
+            outputs = pool.map(f, jobs)
+            concurrent.append((name, time.time() - start))
+            assert outputs == [compiled] * args.copies, 'outputs of %s differ' % name
+            pool.close()
+            pool.join()
+    finally:
+        sys.stderr = stderr
+    print('%d entries, reading them takes %.2fs' % (n, read))
+    print('token lists: %8.0f entries/s (%.2fs)' % (n / (before - read), before))
+    print('bytecode:    %8.0f entries/s (%.2fs)' % (n / (after - read), after))
+    print('streamed to a file: %8.0f entries/s (%.2fs)' % (n / (streamed - read), streamed))
+    print('traced:      %8.0f entries/s (%.2fs)' % (n / (traced - read), traced))
+    print('ITERATE on %d processes: %8.0f entries/s (%.2fs), same output' % (args.jobs, n / (parallel - read), parallel))
+    for name, t in concurrent:
+        print('%d copies on %d %s: %.2fs, same output' % (args.copies, args.jobs, name, t))
+    if args.trace:
+        print()
+        trace.report(limit=20)
+
+
+def main():
+    argparser = ArgumentParser(description='bibcheck micro-benchmarks')
+    subparsers = argparser.add_subparsers(dest='benchmark')
+    p = subparsers.add_parser('tokenize', help='Bibparser.tokenize throughput')
+    p.add_argument('bibtex', nargs='?', default=GRAPHS)
+    p.set_defaults(func=tokenize)
+
+    p = subparsers.add_parser('memory', help='memory held by the parsed records')
+    p.add_argument('--copies', type=int, default=50, help='parse the file this many times over. Default=%(default)s')
+    p.add_argument('bibtex', nargs='?', default=GRAPHS)
+    p.set_defaults(func=memory)
+
+    p = subparsers.add_parser('titles', help='title capitalization on titles with many brace groups')
+    p.add_argument('--groups', type=int, default=1000, help='pairs of brace groups in the longest title. Default=%(default)s')
+    p.set_defaults(func=titles)
+
+    p = subparsers.add_parser('authors', help='author list parsing throughput')
+    p.add_argument('bibtex', nargs='?', default=GRAPHS)
+    p.set_defaults(func=authors)
+
+    p = subparsers.add_parser('export', help='CSL-JSON export throughput')
+    p.add_argument('bibtex', nargs='?', default=GRAPHS)
+    p.set_defaults(func=export)
+
+    p = subparsers.add_parser('bst', help='formatting a bibliography with a .bst style')
+    p.add_argument('--style', default=IEEE, help='Default=tests/IEEE.bst')
+    p.add_argument('--copies', type=int, default=4, help='bibliographies formatted concurrently. Default=%(default)s')
+    p.add_argument('-j', '--jobs', type=int, default=2, help='threads or processes formatting them. Default=%(default)s')
+    p.add_argument('--trace', action='store_true', help='print the calls and time of each function, and the instructions run')
+    p.add_argument('bibtex', nargs='?', default=GRAPHS)
+    p.set_defaults(func=bst_)
+
+    args = argparser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,20 @@
+"""Merges JabRef journal abbreviation lists into the abbreviation table, then
+compiles bibcheck/abbreviations.json into bibcheck/abbreviations.db.
+
+    python tools/get-abbreviations.py [journal_abbreviations_*.txt ...]
+
+Merged tables are written to new.json for review; copy it over
+bibcheck/abbreviations.json and re-run without arguments to recompile.
+"""
+from __future__ import print_function
 import json
+import os
 import sys
 
-existing = json.load(open('bibpy/abbreviations.json'))
-existing = [[e[0].encode('utf-8'), e[1].encode('utf-8')] for e in existing]
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from bibcheck import abbrevs
+
+existing = json.load(open(abbrevs.JSON_PATH))
 existing_keys = set(e[1] for e in existing)
 initial_number = len(existing)
 
@@ -10,15 +22,18 @@ initial_number = len(existing)
 # wget http://jabref.sourceforge.net/journals/journal_abbreviations_ams.txt
 
 for file in sys.argv[1:]:
-    items = [[e.strip() for e in line.split(' = ')[::-1]] for line in open(sys.argv[1]) if not line.startswith('#')]
+    items = [[e.strip() for e in line.split(' = ')[::-1]] for line in open(file) if not line.startswith('#')]
 
     for item in items:
         if item[1] not in existing_keys:
             existing.append(item)
 
+if len(sys.argv) > 1:
+    print('Added %d entries' % (len(existing) - initial_number))
 
-print 'Added %d entries' % (len(existing) - initial_number)
+    existing = sorted(existing, key=lambda x: x[1])
+    json.dump(existing, open('new.json', 'w'), indent=4)
+    print('saving to new.json')
 
-existing = sorted(existing, key=lambda x: x[1])
-json.dump(existing, open('new.json', 'w'), indent=4)
-print('saving to new.json')
+abbrevs.compile_table()
+print('compiled %s' % abbrevs.DB_PATH)